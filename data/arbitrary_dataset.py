@@ -15,9 +15,19 @@
 
 """
 
-import os, random, warnings
+import os, random, warnings, hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import omni_torch.data.misc as misc
+import omni_torch.data.path_loader as path_loader
 import omni_torch.data.augmentation as aug
+import omni_torch.data.index_cache as index_cache
+import omni_torch.data.image_cache as image_cache
+import omni_torch.data.collate as collate
+import omni_torch.data.sampler as sampler
+import omni_torch.data.storage as storage
+import omni_torch.data.image_header as image_header
+import omni_torch.data.profiler as profiler
 
 class Arbitrary_Dataset(object):
     def __init__(self, args, sources, step_1, step_2, pre_process=None, bbox_loader=None,
@@ -34,14 +44,18 @@ class Arbitrary_Dataset(object):
         :param auxiliary_info: when loading path from a folder, it might contains some subfolders you don't
          want to load or other operations you wanted to add.
         you to load as deep as you want to.
-        :param options: For Future upgrade.
+        :param options: For Future upgrade. verbose=True prints more information while loading.
         """
         assert len(sources) == len(step_1), \
             "Length of 'sources', 'step_1' must be the same."
         self.args = args
+        self.verbose = options.get("verbose", False)
         self.sources = sources
         self.step_1 = step_1
         self.step_2 = step_2
+        if as_generator:
+            warnings.warn("as_generator is deprecated, use omni_torch.data.streaming_dataset.Streaming_Dataset "
+                          "to stream the dataset.")
         self.as_generator = as_generator
 
         num_of_data = len(step_2)
@@ -50,6 +64,8 @@ class Arbitrary_Dataset(object):
         self.bbox_loader = self.standardize_input(bbox_loader, num_of_data)
         if args.do_imgaug:
             self.augmentation = self.standardize_input(augmentation, num_of_data)
+        else:
+            self.augmentation = [None] * num_of_data
         if args.to_final_size:
             self.sizes = args.final_size
             assert len(self.sizes) == num_of_data
@@ -60,8 +76,10 @@ class Arbitrary_Dataset(object):
             self.sizes = [None] * num_of_data
         
     def prepare(self):
-        if len(self.sources) == 1:
+        if len(self.sources) == 1 and type(self.sources[0]) is str:
             print("Loading data from: %s."%(os.path.join(self.args.path, self.sources[0])))
+        elif len(self.sources) == 1:
+            print("Loading data from: %s."%([os.path.join(self.args.path, _) for _ in self.sources[0]]))
         elif len(self.sources) > 1:
             print("Loading data from %s locations."%(len(self.sources)))
             for i, source in enumerate(self.sources):
@@ -74,9 +92,209 @@ class Arbitrary_Dataset(object):
                     raise TypeError
         else:
             raise ValueError("Length of the source must be larger than 0")
-        self.dataset = self.load_dataset()
+        if self.args.incremental_refresh:
+            # Recorded before listing the folders, the files added meanwhile are picked up by refresh()
+            self.watched_mtimes = index_cache.watched_mtimes(self, leaf_only=self.lists_folder())
+        if self.args.index_cache_dir:
+            self.dataset = index_cache.load_or_build(self, rebuild=self.args.index_cache_rebuild)
+        else:
+            self.dataset = self.load_dataset()
+        if self.args.compact_dataset:
+            # Forked DataLoader workers will not copy the index by touching the reference count
+            self.dataset = storage.pack_dataset(self.dataset)
+        if self.args.prescan_headers:
+            self.prescan()
+        if self.args.random_order_load:
+            # The seed is drawn here so that all the DataLoader workers share the same permutations
+            seed = self.args.seed if self.args.deterministic_train else random.randint(0, 2 ** 31 - 1)
+            self.permutation = sampler.Source_Permutation(len(self.dataset), len(self.dataset[0]), seed)
+        if self.args.shared_img_cache_bytes:
+            # Created before DataLoader forks or spawns its workers, so they share the same cache
+            # One slot for each image of the dataset
+            slots = image_cache.Shared_Image_Cache.table_slots(self.args.shared_img_cache_bytes,
+                                                               len(self.dataset) * len(self.step_2))
+            self.shared_img_cache = image_cache.Shared_Image_Cache(self.args.shared_img_cache_bytes, slots=slots,
+                                                                   context=self.args.shared_img_cache_context)
+        if self.args.profile_stages:
+            # Report by self.profiler.report() at the end of each epoch
+            self.profiler = profiler.Stage_Profiler(context=self.args.shared_img_cache_context)
+        if self.args.incremental_refresh:
+            # Samples are appended to and tombstoned from the index by refresh(), see its comment
+            self.tombstones = np.zeros(0, dtype=np.int64)
+            if isinstance(self.dataset, storage.Subset_Dataset):
+                self.dataset = storage.Subset_Dataset(storage.Appendable_Dataset(self.dataset.dataset),
+                                                      self.dataset.indices)
+            else:
+                self.dataset = storage.Subset_Dataset(storage.Appendable_Dataset(self.dataset),
+                                                      np.arange(len(self.dataset)))
         print("Number of samples in dataset is: %s"%(len(self.dataset)))
 
+    def lists_folder(self):
+        """
+        Whether the samples are the files in the source folders listed by
+        path_loader.load_path_from_folder, so they can be refreshed folder by folder.
+        """
+        return len(self.step_1) == 1 and self.step_1[0] is path_loader.load_path_from_folder \
+            and type(self).load_dataset is Arbitrary_Dataset.load_dataset
+
+    def refresh(self):
+        """
+        Pick up the files added to or deleted from the sources since prepare() or the last refresh(),
+        without rebuilding the dataset. Requires args.incremental_refresh.
+
+        Nothing is listed if the mtime of the watched folders did not change. When the samples are
+        listed by path_loader.load_path_from_folder, only the changed folders on the last level
+        are listed again, otherwise load_dataset() is called and its samples are compared with the
+        index. New samples are appended to self.dataset.dataset. Deleted samples are tombstoned:
+        they stay in self.dataset.dataset, but their indices are moved from self.dataset.indices
+        to self.tombstones, so the other samples never change their indices in self.dataset.dataset.
+        With args.prescan_headers, the headers of the new samples are read and the unreadable
+        ones are quarantined.
+
+        Call it between epochs, DataLoader workers see the change when they are started again,
+        i.e. not with persistent_workers. Samplers built on len(self) or self.image_headers,
+        e.g. sampler.Aspect_Ratio_Batch_Sampler, should be created again.
+        :return: number of added samples and number of deleted samples
+        """
+        assert getattr(self, "watched_mtimes", None) is not None, \
+            "set args.incremental_refresh to True before prepare()."
+        lists_folder = self.lists_folder()
+        mtimes = index_cache.watched_mtimes(self, leaf_only=lists_folder)
+        if mtimes == self.watched_mtimes:
+            return 0, 0
+        base, active = self.dataset.dataset, self.dataset.indices
+        if lists_folder:
+            added, deleted = self.diff_folders(base, active, mtimes)
+        else:
+            added, deleted = self.diff_samples(base, active)
+        self.watched_mtimes = mtimes
+        if getattr(self, "quarantine", None):
+            # Quarantined samples are not in active either, but they are not new
+            added = [sample for sample in added if sample[self.header_field] not in self.quarantine]
+        keep = np.ones(len(active), dtype=bool)
+        keep[deleted] = False
+        self.tombstones = np.concatenate([self.tombstones, active[~keep]])
+        active = active[keep]
+        if getattr(self, "image_headers", None) is not None:
+            headers = self.image_headers[keep]
+            if added:
+                new_headers = image_header.scan_headers([sample[self.header_field] for sample in added],
+                                                        threads=max(self.args.scan_threads, 1))
+                readable = new_headers[:, 0] >= 0
+                unreadable = [sample[self.header_field] for sample, ok in zip(added, readable) if not ok]
+                if unreadable:
+                    self.quarantine.update(unreadable)
+                    warnings.warn("%d unreadable images are quarantined, see self.quarantine" % len(unreadable))
+                added = [sample for sample, ok in zip(added, readable) if ok]
+                headers = np.concatenate([headers, new_headers[readable]])
+            self.image_headers = headers
+        if added:
+            start = len(base)
+            base.append(storage.pack_dataset(added) if self.args.compact_dataset else added)
+            active = np.concatenate([active, np.arange(start, start + len(added))])
+        self.dataset = storage.Subset_Dataset(base, active)
+        if self.args.random_order_load:
+            self.permutation = sampler.Source_Permutation(len(self.dataset), self.permutation.sources,
+                                                          self.permutation.seed)
+        print("Refreshed dataset: %d samples added, %d deleted, %d in total."
+              % (len(added), len(deleted), len(self.dataset)))
+        return len(added), len(deleted)
+
+    def diff_folders(self, base, active, mtimes):
+        """
+        List the changed folders on the last level and compare them with the paths in the index
+        by file name, the paths of the unchanged folders are not touched.
+        :return: new samples, and positions of the deleted samples in active
+        """
+        changed = [folder for folder in set(self.watched_mtimes) | set(mtimes)
+                   if self.watched_mtimes.get(folder) != mtimes.get(folder)]
+        # The removed folders are empty
+        listings = {os.path.normpath(folder): {} for folder in changed}
+        existing = sorted([folder for folder in changed if mtimes.get(folder) is not None])
+        extensions = frozenset(self.args.extensions) if self.args.extensions else None
+        with ThreadPoolExecutor(max_workers=max(self.args.scan_threads, 1)) as pool:
+            for folder, paths in zip(existing, pool.map(lambda _: path_loader.scan_folder(_, extensions), existing)):
+                listings[os.path.normpath(folder)] = {os.path.basename(path): path for path in paths}
+        deleted = []
+        for position, index in enumerate(active.tolist()):
+            path = base[index][0]
+            listing = listings.get(os.path.normpath(os.path.dirname(path)))
+            # Paths found in the listing are removed from it, the rest of the listing is new
+            if listing is not None and listing.pop(os.path.basename(path), None) is None:
+                deleted.append(position)
+        added = [[path] for folder in sorted(listings) for path in sorted(listings[folder].values())]
+        return added, deleted
+
+    def diff_samples(self, base, active):
+        """
+        Compare the samples returned by load_dataset() with the index
+        :return: new samples, and positions of the deleted samples in active
+        """
+        def key(sample):
+            return tuple([tuple(_) if type(_) is list else _ for _ in sample])
+        samples = self.load_dataset()
+        current = {}
+        for i in range(len(samples)):
+            current.setdefault(key(samples[i]), samples[i])
+        deleted = []
+        for position, index in enumerate(active.tolist()):
+            if current.pop(key(base[index]), None) is None:
+                deleted.append(position)
+        return [list(_) for _ in current.values()], deleted
+
+    def prescan(self, field=0):
+        """
+        Read the headers (height, width, channels, bit_depth) of the images in the given field
+        of each sample in parallel, without decoding them (see image_header.scan_headers).
+        Samples whose image is unreadable or truncated are quarantined: they are removed from
+        self.dataset, and kept in the set self.quarantine and listed in a text file next to the headers.
+        The headers are saved as a .npy file keyed by args.path and the image paths, in
+        args.index_cache_dir (or storage.DEFAULT_CACHE_DIR, so the dataset folder is never written),
+        and reused until the index changes or args.index_cache_rebuild is set.
+        When the cache cannot be written, the headers are only kept in memory.
+        :param field: index of the image paths in each sample
+        :return: self.image_headers, int32 array in shape of (len(self), 4)
+        """
+        if isinstance(self.dataset, storage.Column_Dataset):
+            paths = self.dataset.columns[field]
+        else:
+            paths = [sample[field] for sample in self.dataset]
+        if isinstance(paths, storage.Packed_Strings):
+            identity = paths.prefix.encode("utf-8") + paths.offsets.tobytes() + paths.buffer.tobytes()
+        else:
+            identity = "\n".join(paths).encode("utf-8")
+        path = os.path.expanduser(self.args.path)
+        cache_dir = storage.writable_cache_dir(self.args)
+        digest = hashlib.sha1(b"%d\0" % image_header.SCAN_VERSION + path.encode("utf-8") + b"\0" + identity)
+        prefix = None if cache_dir is None else os.path.join(cache_dir, "headers_%s" % digest.hexdigest()[:16])
+        if prefix is not None and os.path.exists(prefix + ".npy") and not self.args.index_cache_rebuild:
+            headers = np.load(prefix + ".npy")
+        else:
+            headers = image_header.scan_headers(paths, threads=max(self.args.scan_threads, 1))
+            if prefix is not None:
+                try:
+                    storage.save_array(prefix + ".npy", headers)
+                except OSError as e:
+                    warnings.warn("Cannot write the image headers to %s (%s), they are kept in memory."
+                                  % (prefix, e))
+                    prefix = None
+        unreadable = np.flatnonzero(headers[:, 0] < 0)
+        self.quarantine = set([paths[i] for i in unreadable])
+        if len(unreadable) > 0:
+            if prefix is not None:
+                with open(prefix + "_quarantine.txt", "w") as file:
+                    file.write("\n".join(sorted(self.quarantine)) + "\n")
+                warnings.warn("%d unreadable images are quarantined, see %s"
+                              % (len(unreadable), prefix + "_quarantine.txt"))
+            else:
+                warnings.warn("%d unreadable images are quarantined, see self.quarantine" % len(unreadable))
+            readable = np.flatnonzero(headers[:, 0] >= 0)
+            self.dataset = storage.Subset_Dataset(self.dataset, readable)
+            headers = headers[readable]
+        self.image_headers = headers
+        self.header_field = field
+        return headers
+
     def summary(self):
         #print("data loading pipeline summarization function will be implemented soon")
         for i, source in enumerate(self.sources):
@@ -115,40 +333,58 @@ class Arbitrary_Dataset(object):
         return len(self.dataset)
         
     def __getitem__(self, index):
-        result = []
         if self.args.random_order_load:
-            items = []
-            item_num = len(self.dataset[0])
-            up_range = len(self.dataset)
-            selected_j = []
-            for i in range(item_num):
-                j = random.randint(0, up_range-1)
-                # avoid repeated elements
-                while j in selected_j:
-                    #print("repeat element ENCOUNTERED!")
-                    j = random.randint(0, up_range - 1)
-                selected_j.append(j)
-                items.append(self.dataset[j][i])
+            # Each source is read in its own permutation of the current epoch
+            order = self.permutation.get(self.args.curr_epoch)
+            items = [self.dataset[int(order[i, index])][i] for i in range(len(order))]
         else:
             items = self.dataset[index]
-        assert len(items) is len(self.step_2), "length of item and mode should be same."
         if self.args.deterministic_train:
             seed = index + self.args.curr_epoch
         else:
             # seed is used to keep same image augmentation manner when load things from one item
             seed = random.randint(0, 100000)
+        return self.load_item(items, seed)
+
+    def defers_augmentation(self, i, item):
+        """
+        Whether the augmentation of source i is left to collate.Batch_Augmentation.
+        Only a single image without bounding boxes is augmented with the batch, the boxes
+        would not be transformed, so the other sources are still augmented sample by sample.
+        """
+        return self.args.batch_imgaug and self.augmentation[i] is not None and \
+            self.bbox_loader[i] is None and (type(item) is str or type(item) is bytes)
+
+    def load_item(self, items, seed):
+        """
+        Convert the step_1 output of one sample to PyTorch readable data by step_2 functions.
+        :param items: one element of self.dataset
+        :param seed: keep the same augmentation manner inside one sample
+        """
+        assert len(items) == len(self.step_2), "length of item and mode should be same."
+        start = profiler.tick()
+        result = []
         for i in range(len(items)):
-            if callable(self.step_2[i]):
+            if not callable(self.step_2[i]):
+                raise TypeError
+            if self.defers_augmentation(i, items[i]):
+                # Augmentation and to_tensor will be done on the whole batch by collate.Batch_Augmentation
+                image = self.step_2[i](args=self.args, items=items[i], seed=seed, size=self.sizes[i],
+                                       pre_process=self.pre_process[i], rand_aug=None,
+                                       bbox_loader=self.bbox_loader[i], _to_tensor=False)
+                assert isinstance(image, np.ndarray), \
+                    "args.batch_imgaug needs one image from source %d, got %s, " \
+                    "check the pre_process of it." % (i, type(image).__name__)
+                result.append(collate.Deferred_Image(image, seed))
+            else:
                 result.append(self.step_2[i](args=self.args, items=items[i], seed=seed, size=self.sizes[i],
                                              pre_process=self.pre_process[i], rand_aug=self.augmentation[i],
                                              bbox_loader=self.bbox_loader[i]))
-            else:
-                raise TypeError
-        if self.as_generator:
-            yield result
-        else:
-            return result
-        
+        if start is not None:
+            profiler.tock("sample", start)
+            profiler.flush()
+        return result
+
 
     def load_dataset(self):
         """
@@ -182,6 +418,9 @@ class Arbitrary_Dataset(object):
         data_pieces = max([len(_) for _ in data])
         for key in range(len(data)):
             data[key] = misc.compliment_dim(data[key], data_pieces)
+        if all([type(_) is not list for _ in data]):
+            # e.g. numpy arrays or packed strings, do not create a Python list for each sample
+            return storage.Column_Dataset(data)
         for i in range(data_pieces):
             dataset.append([_[i] for _ in data])
         return dataset
@@ -44,7 +44,7 @@ def prepare_augmentation(args):
         ]})
     if args.do_resize:
         aug_dict.update({"resize": [
-            augmenters.Resize(size=args.resize_size)
+            augmenters.Resize(size=args.resize_size, name="resize")
         ]})
     if args.do_crop:
         crop_px = tuple(args.crop_pixel) if args.crop_pixel else None
@@ -0,0 +1,243 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os, sys, json, time, argparse, itertools, resource, traceback
+import queue as queue_module
+import multiprocessing as mpi
+import cv2
+import numpy as np
+import torch
+
+"""
+Benchmark of the data loading pipeline, the entry point is __main__.py:
+
+    python -m omni_torch.data bench --images 2000 --resolution 512x384 --format jpg \\
+        --workers 0,4 --batch-sizes 32 --cache none,shared --augmentation none,imgaug,single_warp \\
+        --output result.json
+
+A synthetic dataset is generated (and reused) under --root, then every combination of the
+swept settings runs in a fresh process, so the peak RSS of one does not leak into another.
+Forked workers count the pages shared with their parent in peak_workers_rss_mb as well,
+so the number is an upper bound of their memory.
+"""
+
+WRITE_FLAGS = {"jpg": [cv2.IMWRITE_JPEG_QUALITY, 90], "png": [cv2.IMWRITE_PNG_COMPRESSION, 3],
+               "tif": [], "bmp": []}
+CACHES = ("none", "lru", "shared")
+AUGMENTATIONS = ("none", "imgaug", "single_warp", "batch_torch")
+
+
+def generate_dataset(root, images, resolution, format="jpg", channels=3, seed=0):
+    """
+    Write images of smooth random patterns into root/source and root/target (the target
+    images have the same names, for Img2Img_Dataset). The dataset is reused when it was
+    generated with the same settings.
+    :param resolution: (height, width)
+    """
+    meta = {"images": images, "resolution": list(resolution), "format": format,
+            "channels": channels, "seed": seed}
+    meta_path = os.path.join(root, "bench_meta.json")
+    if os.path.exists(meta_path):
+        with open(meta_path) as file:
+            if json.load(file) == meta:
+                return root
+    rng = np.random.RandomState(seed)
+    height, width = resolution
+    for folder in ("source", "target"):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+    for i in range(images):
+        # Up-sampled noise compresses like natural images, unlike pure noise
+        small = rng.randint(0, 256, size=(max(height // 16, 1), max(width // 16, 1), channels), dtype=np.uint8)
+        image = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+        for folder in ("source", "target"):
+            cv2.imwrite(os.path.join(root, folder, "%08d.%s" % (i, format)), image, WRITE_FLAGS[format])
+    with open(meta_path, "w") as file:
+        json.dump(meta, file)
+    return root
+
+
+def bench_options(config):
+    import omni_torch.options.options_edict as edict_options
+    args = edict_options.initialize()
+    args.path = config["root"]
+    args.img_channel = config["channels"]
+    args.extensions = [config["format"]]
+    # Not defined in options_edict but read by prepare_augmentation
+    args.do_resize, args.do_crop = False, False
+    if config["cache"] == "lru":
+        args.img_cache_bytes = config["cache_bytes"]
+    elif config["cache"] == "shared":
+        args.shared_img_cache_bytes = config["cache_bytes"]
+    if config["augmentation"] != "none":
+        args.do_imgaug = True
+        args.do_affine = True
+        args.rotation = (-10.0, 10.0)
+        args.scale_x, args.scale_y = (0.9, 1.1), (0.9, 1.1)
+        args.do_random_flip = True
+        args.do_random_brightness = True
+        args.multiplier = (0.8, 1.2)
+        args.single_warp = config["augmentation"] == "single_warp"
+        if config["augmentation"] == "batch_torch":
+            args.batch_imgaug = True
+            args.batch_aug_backend = "torch"
+    return args
+
+
+def build_dataset(args, config):
+    import omni_torch.data.augmentation as aug
+    import omni_torch.data.data_loader as loader
+    import omni_torch.data.path_loader as path_loader
+    from omni_torch.data.arbitrary_dataset import Arbitrary_Dataset
+    from omni_torch.data.img2img_dataset import Img2Img_Dataset
+    augmentation = [aug.prepare_augmentation(args)] * 2 if args.do_imgaug else None
+    if config["dataset"] == "img2img":
+        return Img2Img_Dataset(args, ["source", "target"], [path_loader.load_path_from_folder] * 2,
+                               [loader.read_image] * 2, auxiliary_info=[0] * 2, augmentaion=augmentation)
+    return Arbitrary_Dataset(args, ["source"], [path_loader.load_path_from_folder], [loader.read_image],
+                             auxiliary_info=[0], augmentation=None if augmentation is None else augmentation[:1])
+
+
+def peak_rss(pid="self"):
+    """
+    :return: peak resident set size of a process in MB, read from /proc on Linux
+    """
+    try:
+        with open("/proc/%s/status" % pid) as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid == "self":
+        scale = 1 / 1024 / 1024 if sys.platform == "darwin" else 1 / 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    return 0.0
+
+
+def run(config):
+    import omni_torch.data.collate as collate
+    args = bench_options(config)
+    start = time.time()
+    dataset = build_dataset(args, config)
+    dataset.prepare()
+    result = dict(config, prepare_seconds=time.time() - start, samples_per_second=[], peak_workers_rss_mb=0.0)
+    collate_fn = collate.Batch_Augmentation(args, dataset.augmentation) if args.batch_imgaug else None
+    start = time.time()
+    for epoch in range(config["epochs"]):
+        args.curr_epoch = epoch
+        epoch_start, samples = time.time(), 0
+        data_loader = torch.utils.data.DataLoader(dataset, batch_size=config["batch_size"], shuffle=True,
+                                                  num_workers=config["workers"], collate_fn=collate_fn)
+        for i, batch in enumerate(data_loader):
+            if "time_to_first_batch" not in result:
+                result["time_to_first_batch"] = time.time() - start
+            samples += len(batch[0])
+            if config["workers"]:
+                # Sum of the DataLoader workers, which are shut down as soon as the last batch is
+                # fetched, and VmHWM only grows, so it is read at every batch
+                workers_rss = sum([peak_rss(_.pid) for _ in mpi.active_children()])
+                result["peak_workers_rss_mb"] = max(result["peak_workers_rss_mb"], workers_rss)
+            if config["max_batches"] and i + 1 >= config["max_batches"]:
+                break
+        del data_loader
+        result["samples_per_second"].append(samples / (time.time() - epoch_start))
+    result["peak_rss_mb"] = peak_rss()
+    return result
+
+
+def run_in_process(config, queue):
+    # Keep the printing of datasets out of the JSON output
+    sys.stdout = open(os.devnull, "w")
+    # A spawned process spawns its children as well, which is not how the workers are started in training
+    mpi.set_start_method(config["start_method"], force=True)
+    try:
+        queue.put(run(config))
+    except Exception:
+        queue.put(dict(config, error=traceback.format_exc()))
+
+
+def sweep(configs):
+    context = mpi.get_context("spawn")
+    results = []
+    for config in configs:
+        queue = context.Queue()
+        process = context.Process(target=run_in_process, args=(config, queue))
+        process.start()
+        result = None
+        while result is None:
+            try:
+                result = queue.get(timeout=1)
+            except queue_module.Empty:
+                if not process.is_alive():
+                    result = dict(config, error="the process exited with code %s" % process.exitcode)
+        process.join()
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return results
+
+
+def split(value, type=str):
+    return [type(_) for _ in value.split(",") if _]
+
+
+def bench(argv):
+    parser = argparse.ArgumentParser(prog="python -m omni_torch.data bench",
+                                     description="Benchmark the data loading pipeline on a synthetic dataset.")
+    parser.add_argument("--root", default=os.path.join(os.path.expanduser("~"), ".omth_bench"),
+                        help="folder of the synthetic dataset")
+    parser.add_argument("--images", type=int, default=1000)
+    parser.add_argument("--resolution", default="256x256", help="HEIGHTxWIDTH")
+    parser.add_argument("--format", default="jpg", choices=sorted(WRITE_FLAGS))
+    parser.add_argument("--channels", type=int, default=3, choices=[1, 3])
+    parser.add_argument("--dataset", default="arbitrary", help="comma separated: arbitrary,img2img")
+    parser.add_argument("--workers", default="0,2", help="comma separated num_workers")
+    parser.add_argument("--batch-sizes", default="32", help="comma separated batch sizes")
+    parser.add_argument("--cache", default="none", help="comma separated: %s" % ",".join(CACHES))
+    parser.add_argument("--cache-bytes", type=int, default=2 ** 30)
+    parser.add_argument("--augmentation", default="none", help="comma separated: %s" % ",".join(AUGMENTATIONS))
+    parser.add_argument("--epochs", type=int, default=2, help="caches only help from the second epoch")
+    parser.add_argument("--start-method", default="fork" if "fork" in mpi.get_all_start_methods() else "spawn",
+                        choices=mpi.get_all_start_methods(), help="how DataLoader workers are started")
+    parser.add_argument("--max-batches", type=int, default=0, help="batches per epoch, 0 means all")
+    parser.add_argument("--output", default=None, help="write the JSON here instead of stdout")
+    options = parser.parse_args(argv)
+    height, width = [int(_) for _ in options.resolution.lower().split("x")]
+    for cache in split(options.cache):
+        assert cache in CACHES, "unknown cache mode: %s" % cache
+    for augmentation in split(options.augmentation):
+        assert augmentation in AUGMENTATIONS, "unknown augmentation: %s" % augmentation
+    root = os.path.expanduser(options.root)
+    start = time.time()
+    generate_dataset(root, options.images, (height, width), options.format, options.channels)
+    print("Synthetic dataset ready in %.1f seconds: %s" % (time.time() - start, root), file=sys.stderr)
+    configs = []
+    for dataset, workers, batch_size, cache, augmentation in itertools.product(
+            split(options.dataset), split(options.workers, int), split(options.batch_sizes, int),
+            split(options.cache), split(options.augmentation)):
+        configs.append({"root": root, "images": options.images, "resolution": [height, width],
+                        "format": options.format, "channels": options.channels, "dataset": dataset,
+                        "workers": workers, "batch_size": batch_size, "cache": cache,
+                        "cache_bytes": options.cache_bytes, "augmentation": augmentation,
+                        "epochs": options.epochs, "max_batches": options.max_batches,
+                        "start_method": options.start_method})
+    report = {"torch": torch.__version__, "opencv": cv2.__version__, "cpus": os.cpu_count(),
+              "results": sweep(configs)}
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
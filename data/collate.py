@@ -0,0 +1,186 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import numpy as np
+import torch
+from torch.utils.data.dataloader import default_collate
+from imgaug import augmenters
+import omni_torch.data.data_loader as loader
+from omni_torch.data.torch_augmentation import Torch_Augmentation
+
+
+class Deferred_Image(object):
+    """
+    An image returned by __getitem__ when args.batch_imgaug is on, its augmentation
+    and conversion to tensor are left to Batch_Augmentation.
+    """
+    __slots__ = ("image", "seed")
+
+    def __init__(self, image, seed):
+        self.image = image
+        self.seed = seed
+
+
+class Batch_Augmentation(object):
+    def __init__(self, args, augmentation):
+        """
+        A collate_fn of DataLoader, which augments all the images of one batch together
+        by imgaug's augment_images instead of building a Sequential for each sample.
+        It runs inside the DataLoader workers as well.
+
+        Usage:
+            args.batch_imgaug = True
+            dataset = Arbitrary_Dataset(args, ..., augmentation=augmentation)
+            DataLoader(dataset, collate_fn=Batch_Augmentation(args, augmentation))
+
+        With args.batch_aug_backend == "torch", sources with augmentation are augmented
+        by Torch_Augmentation built from args instead of the imgaug augmenters.
+
+        Sources with bbox_loader or with several images in one item are still augmented
+        in __getitem__, see Arbitrary_Dataset.defers_augmentation.
+
+        :param augmentation: the same augmentation passed to the dataset,
+                a list contains a list of imgaug augmenters (or None) for each source
+        """
+        self.args = args
+        self.sequences = [None if aug_list is None else augmenters.Sequential(aug_list, random_order=False)
+                          for aug_list in augmentation]
+        self.engine = Torch_Augmentation(args) if args.batch_aug_backend == "torch" else None
+
+    def augment(self, i, deferred):
+        images = [_.image for _ in deferred]
+        if self.sequences[i] is not None:
+            # The seed of the batch is decided by the seeds of its samples,
+            # so under args.deterministic_train the augmentation is reproducible
+            seeds = np.array([_.seed for _ in deferred], dtype=np.int64)
+            batch_seed = int(np.random.RandomState(seeds % (2 ** 32)).randint(0, 2 ** 31 - 1))
+            if self.engine is not None:
+                return self.augment_by_torch(images, batch_seed)
+            sequence = self.sequences[i].deepcopy()
+            if hasattr(sequence, "seed_"):
+                sequence.seed_(batch_seed)
+            else:
+                sequence.reseed(batch_seed)
+            images = sequence.augment_images(images)
+        tensors = []
+        for image in images:
+            if len(image.shape) == 2:
+                image = np.expand_dims(image, axis=-1)
+            tensors.append(loader.to_tensor(self.args, image))
+        return torch.stack(tensors, dim=0)
+
+    def augment_by_torch(self, images, seed):
+        assert len(set([_.shape for _ in images])) == 1, \
+            "images of one batch should have the same shape to be augmented by torch."
+        images = np.stack(images)
+        if len(images.shape) == 3:
+            images = np.expand_dims(images, axis=-1)
+        images = torch.from_numpy(images).permute(0, 3, 1, 2)
+        if images.dtype != torch.uint8:
+            images = images.float()
+        return normalize_batch(self.args, self.engine(images, seed))
+
+    def __call__(self, batch):
+        result = []
+        for i in range(len(batch[0])):
+            values = [sample[i] for sample in batch]
+            if type(values[0]) is Deferred_Image:
+                result.append(self.augment(i, values))
+            else:
+                result.append(default_collate(values))
+        return result
+
+
+def normalize_batch(args, images):
+    """
+    The same as utils.normalize_image, on a (B, C, H, W) tensor
+    """
+    if images.shape[1] == 1:
+        mean = 0.29 * args.img_mean[0] + 0.59 * args.img_mean[1] + 0.12 * args.img_mean[2]
+        std = sum(args.img_std) / len(args.img_std)
+        bias = sum(args.img_bias) / len(args.img_bias)
+        mean, std, bias = [torch.tensor([_], dtype=torch.float32) for _ in (mean, std, bias)]
+    elif images.shape[1] == 3:
+        mean, std, bias = [torch.tensor(_, dtype=torch.float32) for _ in (args.img_mean, args.img_std, args.img_bias)]
+    else:
+        raise RuntimeError("image channel should either be 1 or 3")
+    images = images.float() / 2 ** args.img_bit
+    return (images - mean[:, None, None]) / std[:, None, None] + bias[:, None, None]
+
+
+class Padded_Collate(object):
+    def __init__(self, args, pad_value=0.0):
+        """
+        A collate_fn of DataLoader for samples of different sizes, e.g. with Aspect_Ratio_Batch_Sampler.
+        Images, i.e. tensors in shape of (C, H, W), are padded at the bottom and right to the maximum
+        height and width of the batch rounded up to args.standardize_gcd, into one preallocated tensor.
+        For each field of the samples it returns:
+            images: (images, mask), mask is a bool tensor in shape of (B, H, W), True on the real pixels
+            (image, coords, labels) of read_image_with_bbox: (images, mask, coords, labels, offsets),
+                coords and labels of all the images are concatenated, boxes of the i-th image are
+                coords[offsets[i]:offsets[i + 1]], coords are rescaled to the padded images
+            lists or tuples: collated by each position
+            others: default_collate
+
+        :param pad_value: value of the padded pixels, after normalization
+        """
+        self.args = args
+        self.pad_value = pad_value
+
+    @staticmethod
+    def is_bbox(value):
+        return (type(value) is tuple or type(value) is list) and len(value) == 3 and \
+               isinstance(value[0], torch.Tensor) and value[0].dim() == 3 and \
+               isinstance(value[1], torch.Tensor) and value[1].dim() == 2 and value[1].shape[-1] == 4
+
+    def pad_images(self, images):
+        gcd = max(self.args.standardize_gcd, 1)
+        sizes = torch.tensor([image.shape[1:] for image in images], dtype=torch.int64)
+        height, width = (((sizes.max(dim=0)[0] + gcd - 1) // gcd) * gcd).tolist()
+        first = images[0]
+        batch = first.new_full((len(images), first.shape[0], height, width), self.pad_value)
+        mask = torch.zeros((len(images), height, width), dtype=torch.bool)
+        for i, image in enumerate(images):
+            batch[i, :, :image.shape[1], :image.shape[2]].copy_(image)
+            mask[i, :image.shape[1], :image.shape[2]] = True
+        return batch, mask, sizes, (height, width)
+
+    def collate_bbox(self, values):
+        images, mask, sizes, (height, width) = self.pad_images([_[0] for _ in values])
+        counts = torch.tensor([len(_[1]) for _ in values], dtype=torch.int64)
+        offsets = torch.zeros(len(values) + 1, dtype=torch.int64)
+        offsets[1:] = torch.cumsum(counts, dim=0)
+        coords = torch.cat([_[1] for _ in values], dim=0)
+        labels = torch.cat([_[2] for _ in values], dim=0)
+        # Relative coordinates of each image are scaled by its size over the padded size
+        scale = torch.stack([sizes[:, 1].float() / width, sizes[:, 0].float() / height], dim=1).repeat(1, 2)
+        coords = coords * scale.repeat_interleave(counts, dim=0)
+        return images, mask, coords, labels, offsets
+
+    def collate_field(self, values):
+        first = values[0]
+        if isinstance(first, torch.Tensor) and first.dim() == 3:
+            images, mask = self.pad_images(values)[:2]
+            return images, mask
+        if self.is_bbox(first):
+            return self.collate_bbox(values)
+        if type(first) is tuple or type(first) is list:
+            return [self.collate_field([_[i] for _ in values]) for i in range(len(first))]
+        return default_collate(values)
+
+    def __call__(self, batch):
+        return [self.collate_field([sample[i] for sample in batch]) for i in range(len(batch[0]))]
@@ -6,6 +6,10 @@ import numpy as np
 import omni_torch.data as data
 import omni_torch.utils as util
 import omni_torch.data.augmentation as aug
+import omni_torch.data.image_cache as image_cache
+import omni_torch.data.image_header as image_header
+import omni_torch.data.geometry as geometry
+import omni_torch.data.profiler as profiler
 import imgaug
 from imgaug import augmenters
 
@@ -24,67 +28,107 @@ def read_image_with_bbox(args, items, seed, size, pre_process=None, rand_aug=Non
             ops can also calculate the infomation extactable brom image, e.g. affine matrix
     :return:
     """
+    start = profiler.tick()
     if bbox_loader:
         # image should be an np.ndarray
-        # bbox should be an imgaug BoundingBoxesOnImage instance
+        # bbox should be an array in shape of (N, 4) in (x1, y1, x2, y2) pixel coordinates,
+        # an imgaug BoundingBoxesOnImage instance is also accepted
         image, bbox, box_label = bbox_loader(args, items, seed, size)
+        start = profiler.tock("decode", start)
+        bbox = bbox_to_array(bbox)
+        resize = None
+        start = profiler.tock("bbox", start)
     else:
         path = items
-        image = load_img(args, path)
+        flag = plan_decode(args, path, decode_size(args, size, pre_process, rand_aug))
+        image = load_img(args, path, flag=flag)
         bbox = None
+        # Only the image decoded in a reduced resolution is resized to size afterwards
+        resize = size if is_reduced(flag) else None
+        start = profiler.tock("decode", start)
     if pre_process:
         image, data = pre_process(image, args, items, seed, size)
+        start = profiler.tock("pre_process", start)
     else:
         data = None
-    # If pre-process returns some information about deterministic augmentation
-    # Then initialize the deterministic augmentation based on that information
-    det_aug_list = aug.prepare_deterministic_augmentation(args, data)
-    aug_seq = aug.combine_augs(det_aug_list, rand_aug)
-    if bbox:
-        if aug_seq:
-            # Do random augmentaion defined in pipline declaration
-            aug_seq = aug_seq.to_deterministic()
-            image = aug_seq.augment_image(image)
-            bbox = aug_seq.augment_bounding_boxes([bbox])[0]
-            #image_after = bbox.draw_on_image(image, thickness=2, color=[0, 0, 255])
-            #cv2.imwrite("/home/wang/Pictures/tmp_after.jpg", image_after)
-        # numpy-lize bbox
-        coords = []
-        labels = []
-        h, w = image.shape[0], image.shape[1]
-        for i, box in enumerate(bbox.bounding_boxes):
-            condition_1 = box.x1 <= 0 and box.x2 <= 0
-            condition_2 = box.y1 <= 0 and box.y2 <= 0
-            condition_3 = box.x1 >= w -1 and box.x2 >= w -1
-            condition_4 = box.y1 >= h -1 and box.y2 >= h -1
-            if condition_1 or condition_2 or condition_3 or condition_4:
-                # After aigmentation, at least one dimension of the bbox exceeded the image
-                # omni_torch will ignore this bbox
-                continue
-            horizontal_constrain = lambda x: max(min(w, x), 0)
-            vertival_constrain = lambda y: max(min(h, y), 0)
-            coords.append([horizontal_constrain(box.x1)/w, vertival_constrain(box.y1)/h,
-                           horizontal_constrain(box.x2)/w, vertival_constrain(box.y2)/h])
-            labels.append(box_label[i])
-        coords = torch.Tensor(coords)
-        labels = torch.Tensor(labels)
+    if args.single_warp:
+        # Geometric augmentations and the final resize are done by one warp
+        warp = geometry.plan_warp(args, image.shape, rand_aug, data, resize, seed)
+        image = warp.apply(image)
+        if bbox is not None:
+            bbox = warp.apply_bbox(bbox)
+        aug_seq = aug.combine_augs(None, geometry.strip_geometric(rand_aug))
     else:
-        # With no bounding boxes, augment the image only
-        if aug_seq:
-            aug_seq = aug_seq.to_deterministic()
-            image = aug_seq.augment_image(image)
+        # If pre-process returns some information about deterministic augmentation
+        # Then initialize the deterministic augmentation based on that information
+        det_aug_list = aug.prepare_deterministic_augmentation(args, data)
+        aug_seq = aug.combine_augs(det_aug_list, rand_aug)
+    if aug_seq:
+        # Do random augmentaion defined in pipline declaration
+        aug_seq = aug_seq.to_deterministic()
+        if bbox is not None:
+            bbox = augment_bbox(aug_seq, bbox, image.shape)
+        image = aug_seq.augment_image(image)
+    if resize is not None:
+        # Coordinates of bbox are relative, so they are not affected
+        image = resize_to(image, resize)
+    start = profiler.tock("augmentation", start)
+    if bbox is not None:
+        coords, labels = normalize_bbox(bbox, np.asarray(box_label), image.shape[0], image.shape[1])
+        coords = torch.from_numpy(coords)
+        labels = torch.from_numpy(labels.astype(np.float32))
+        start = profiler.tock("bbox", start)
     if len(image.shape) == 2:
         image = np.expand_dims(image, axis=-1)
     if _to_tensor:
-        if bbox:
-            return to_tensor(args, image, seed, size), coords, labels
-        return to_tensor(args, image, seed, size)
+        tensor = to_tensor(args, image, seed, size)
+        profiler.tock("to_tensor", start)
+        if bbox is not None:
+            return tensor, coords, labels
+        return tensor
     else:
-        if bbox:
+        if bbox is not None:
             return image, coords, labels
         return image
 
 
+def bbox_to_array(bbox):
+    """
+    :return: float32 array in shape of (N, 4)
+    """
+    if isinstance(bbox, imgaug.BoundingBoxesOnImage):
+        return bbox.to_xyxy_array(dtype=np.float32)
+    return np.asarray(bbox, dtype=np.float32).reshape((-1, 4))
+
+
+def augment_bbox(aug_seq, bbox, shape):
+    """
+    Apply a deterministic imgaug sequence to boxes of an image in the given shape
+    :param bbox: array in shape of (N, 4)
+    :return: array in shape of (N, 4)
+    """
+    if len(bbox) == 0:
+        return bbox
+    on_image = imgaug.BoundingBoxesOnImage.from_xyxy_array(bbox, shape=shape)
+    on_image = aug_seq.augment_bounding_boxes([on_image])[0]
+    return on_image.to_xyxy_array(dtype=np.float32)
+
+
+def normalize_bbox(bbox, labels, h, w):
+    """
+    Drop the boxes totally outside of the image after augmentation, clip the others
+    into the image and scale them to [0, 1]
+    :param bbox: array in shape of (N, 4), (x1, y1, x2, y2) in pixels
+    :return: coords in shape of (M, 4) and the labels of them
+    """
+    x1, y1, x2, y2 = bbox[:, 0], bbox[:, 1], bbox[:, 2], bbox[:, 3]
+    outside = ((x1 <= 0) & (x2 <= 0)) | ((y1 <= 0) & (y2 <= 0)) | \
+              ((x1 >= w - 1) & (x2 >= w - 1)) | ((y1 >= h - 1) & (y2 >= h - 1))
+    coords = bbox[~outside]
+    coords = np.clip(coords, 0, [w, h, w, h]) / np.array([w, h, w, h], dtype=np.float32)
+    return coords.astype(np.float32), labels[~outside]
+
+
 def read_image(args, items, seed, size, pre_process=None, rand_aug=None,
                bbox_loader=None, _to_tensor=True):
     """
@@ -99,22 +143,35 @@ def read_image(args, items, seed, size, pre_process=None, rand_aug=None,
             ops can also calculate the infomation extactable brom image, e.g. affine matrix
     :return:
     """
-    if type(items) is str:
+    if type(items) is str or type(items) is bytes:
         items = [items]
-    images = []
-    for path in items:
-        images.append(load_img(args, path))
+    start = profiler.tick()
+    flags = [plan_decode(args, path, decode_size(args, size, pre_process, rand_aug)) for path in items]
+    images = [load_img(args, path, flag=flag) for path, flag in zip(items, flags)]
+    # Resize all the images when one of them is decoded in a reduced resolution, so they stay aligned
+    resize = size if any([is_reduced(flag) for flag in flags]) else None
+    start = profiler.tock("decode", start)
     if pre_process:
         images = pre_process(images, args, items, seed, size)
+        start = profiler.tock("pre_process", start)
+    if args.single_warp:
+        # The same seed gives the same random parameters to each image
+        images = [geometry.plan_warp(args, image.shape, rand_aug, None, resize, seed).apply(image)
+                  for image in images]
+        rand_aug = geometry.strip_geometric(rand_aug)
     aug_seq = augmenters.Sequential(rand_aug, random_order=False)
     if aug_seq:
         aug_seq = aug_seq.to_deterministic()
         images = aug_seq.augment_images(images)
+    if resize is not None:
+        images = [resize_to(image, resize) for image in images]
+    start = profiler.tock("augmentation", start)
     for i, image in enumerate(images):
         if len(image.shape) == 2:
             images[i] = np.expand_dims(image, axis=-1)
     if _to_tensor:
         tensor = [to_tensor(args, image, seed, size) for image in images]
+        profiler.tock("to_tensor", start)
         if len(tensor) == 1:
             return tensor[0]
         else:
@@ -126,16 +183,112 @@ def read_image(args, items, seed, size, pre_process=None, rand_aug=None,
             return images
 
 
-def load_img(args, path):
+def load_img(args, path, size=None, flag=None):
     """
     A generalized image loading function, support n-bit, n-channel images
+    When args.img_cache_bytes is set, decoded images are kept in a LRU cache of each
+    process, so only the augmentation is performed again in the following epochs.
     :param args:
-    :param path: string-path or list of string-paths
+    :param path: string-path, or the encoded bytes of an image file (e.g. read from shards)
+    :param size: (height, width) the image will be resized to afterwards, with args.fast_decode
+            the image may be decoded in a reduced resolution which is not smaller than it
+    :param flag: the flag of cv2.imread returned by plan_decode, planned from size if it is None
     :return:
     """
+    if flag is None:
+        flag = plan_decode(args, path, size)
+    cache = image_cache.get_cache(args) if type(path) is str else None
+    if cache is None:
+        return decode_img(args, path, flag)
+    key = (path, args.img_channel, flag)
+    image = cache.get(key)
+    if image is None:
+        image = decode_img(args, path, flag)
+        cache.put(key, image)
+    # Following steps may modify the image in place
+    return image.copy()
+
+
+# Flags to decode a JPEG file in 1/2, 1/4 and 1/8 resolution
+REDUCED_COLOR = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+REDUCED_GRAY = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+                8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+REDUCED_FLAGS = frozenset(list(REDUCED_COLOR.values()) + list(REDUCED_GRAY.values()))
+
+
+def plan_decode(args, path, size=None):
+    """
+    Decide the flag of cv2.imread for load_img.
+    -1 (decode as it is) is used unless args.fast_decode is on, because the other flags
+    always produce 8-bit images. With args.fast_decode, JPEG files are decoded by libjpeg
+    in the smallest reduced resolution that is still not smaller than size, and
+    grayscale images are decoded directly when args.img_channel is 1.
+    Unlike -1, the other flags rotate the image by its EXIF orientation, which is turned off by
+    cv2.IMREAD_IGNORE_ORIENTATION, so the image matches its labels and the result of -1.
+    """
+    if not args.fast_decode or type(path) is not str or args.img_bit != 8:
+        return -1
+    format, header = image_header.probe(path)
+    if header is None:
+        return -1
+    height, width, channels, bit_depth = header
+    if bit_depth != 8:
+        return -1
+    gray = args.img_channel == 1 or channels == 1
+    reduce = 1
+    if size is not None and format == image_header.JPEG:
+        for factor in (8, 4, 2):
+            if height // factor >= size[0] and width // factor >= size[1]:
+                reduce = factor
+                break
+    if reduce > 1:
+        return (REDUCED_GRAY[reduce] if gray else REDUCED_COLOR[reduce]) | cv2.IMREAD_IGNORE_ORIENTATION
+    if args.img_channel == 1:
+        return cv2.IMREAD_GRAYSCALE | cv2.IMREAD_IGNORE_ORIENTATION
+    return -1
+
+
+def is_reduced(flag):
+    """
+    :return: whether a flag returned by plan_decode decodes the image in a reduced resolution
+    """
+    return flag != -1 and (flag & ~cv2.IMREAD_IGNORE_ORIENTATION) in REDUCED_FLAGS
+
+
+def decode_size(args, size, pre_process, rand_aug):
+    """
+    :return: the size to be passed to load_img, None if later steps need the full resolution,
+            i.e. pre_process, or augmentations defined in pixels
+    """
+    if not args.fast_decode or size is None or pre_process is not None:
+        return None
+    for augmenter in (rand_aug if rand_aug else []):
+        if isinstance(augmenter, (augmenters.CropToFixedSize, augmenters.PadToFixedSize,
+                                  augmenters.Crop, augmenters.Pad)):
+            return None
+    return size
+
+
+def resize_to(image, size):
+    """
+    :param size: (height, width)
+    """
+    if image.shape[0] == size[0] and image.shape[1] == size[1]:
+        return image
+    return cv2.resize(image, (size[1], size[0]), interpolation=cv2.INTER_AREA)
+
+
+def decode_img(args, path, flag=-1):
     # -1 means it adapts to any bit-depth image
     # e.g. 8-bit, 12-bit, 14-bit, 16-bit, and etc.
-    image = cv2.imread(path, -1)
+    if type(path) is bytes:
+        image = cv2.imdecode(np.frombuffer(path, dtype=np.uint8), flag)
+    else:
+        image = cv2.imread(path, flag)
+    if image is None:
+        raise IOError("cv2 cannot decode the image: %s, it might be corrupted or not an image. "
+                      "Use Arbitrary_Dataset.prescan() to quarantine the unreadable images in advance."
+                      % (path if type(path) is str else "<%d bytes>" % len(path)))
     if image.shape[-1] == 4:
         # RGB-A image
         if args.img_channel is 1:
@@ -33,6 +33,13 @@ def segment_image(image, args, path, seed, size, to_tensor=False):
     :return: [w, h, C] => [w/slice_w, h/slice_h, C*slice_w*sliceH]
     """
     assert len(args.segment_patch_size) == 2, "image patch size should contains exactly 2 dimensions"
+    patch_h, patch_w = args.segment_patch_size
+    # Distance between two neighbouring patches, patches overlap when it is smaller than the patch size
+    if args.segment_stride:
+        stride_h, stride_w = (args.segment_stride, args.segment_stride) if type(args.segment_stride) is int \
+            else tuple(args.segment_stride)
+    else:
+        stride_h, stride_w = patch_h, patch_w
     # Format the pieces of slice
     if args.segments:
         assert len(args.segments) <= 2, "slice shoud no longer then 2 dimensions"
@@ -41,34 +48,38 @@ def segment_image(image, args, path, seed, size, to_tensor=False):
         else:
             slice = tuple(args.segments)
     else:
-        slice = (int(image.shape[0] / args.segment_patch_size[0]), int(image.shape[1] / args.segment_patch_size[1]))
+        slice = (max(int((image.shape[0] - patch_h) / stride_h) + 1, 1),
+                 max(int((image.shape[1] - patch_w) / stride_w) + 1, 1))
+    height = patch_h + (slice[0] - 1) * stride_h
+    width = patch_w + (slice[1] - 1) * stride_w
 
     # Confirm the aspect ratio of input image and output image
     ori_ratio = image.shape[1] / image.shape[0]
-    new_ratio = args.segment_patch_size[1] * slice[1] / args.segment_patch_size[0] / slice[0]
+    new_ratio = width / height
     if ori_ratio / new_ratio > 1.3 or ori_ratio / new_ratio < 0.7:
         warnings.warn(
             "the ratio of output image is significantly different from original image, please modify the slice or output_size")
 
     # Perform segmentation
-    image = cv2.resize(image, (args.segment_patch_size[0]*slice[0], args.segment_patch_size[1]*slice[1]))
+    image = cv2.resize(image, (width, height))
     if len(image.shape) == 2:
         # When it was a grayscale image:
         image = np.expand_dims(image, axis=-1)
-    imgs = []
+    # A view in shape of [slice_h, slice_w, patch_h, patch_w, C], nothing is copied here
+    row, col, channel = image.strides
+    patches = np.lib.stride_tricks.as_strided(
+        image, shape=(slice[0], slice[1], patch_h, patch_w, image.shape[2]),
+        strides=(row * stride_h, col * stride_w, row, col, channel), writeable=False)
     if to_tensor:
-        for i in range(slice[0]):
-            for j in range(slice[1]):
-                img = T.ToTensor()(image[i * args.segment_patch_size[0]:(i + 1) * args.segment_patch_size[1],
-                                                              j * args.segment_patch_size[1]:(j + 1) * args.segment_patch_size[1], :])
-                imgs.append(torch.unsqueeze(img, 0))
-        return torch.cat(imgs, dim=0)
+        # Same as T.ToTensor() on each patch: [N, C, patch_h, patch_w], uint8 is scaled to [0, 1]
+        patches = np.ascontiguousarray(patches.transpose((0, 1, 4, 2, 3)))
+        tensor = torch.from_numpy(patches.reshape((-1, image.shape[2], patch_h, patch_w)))
+        if tensor.dtype == torch.uint8:
+            return tensor.float().div(255)
+        return tensor
     else:
-        for i in range(slice[0]):
-            for j in range(slice[1]):
-                imgs.append(image[i * args.segment_patch_size[0]:(i + 1) * args.segment_patch_size[1],
-                    j * args.segment_patch_size[1]:(j + 1) * args.segment_patch_size[1], :])
-        return imgs
+        patches = np.ascontiguousarray(patches).reshape((-1, patch_h, patch_w, image.shape[2]))
+        return list(patches)
     
 
 def contrast_normalization(image, args, path, seed, size):
@@ -0,0 +1,268 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import math
+import cv2
+import numpy as np
+from imgaug import augmenters
+
+"""
+Fold the geometric augmentations (the deterministic rotation and crop, affine, resize, crop,
+crop_to_fix, pad, flip and the final resize) into one 2x3 matrix, so the pixels are
+resampled only once by cv2.warpAffine, directly into the output size.
+Enabled by args.single_warp, see data_loader.read_image_with_bbox.
+"""
+
+# Geometric augmenters created by augmentation.prepare_augmentation, matched by their name,
+# which are replaced by the warp. Their parameters are read from args.
+GEOMETRIC = {"rand_affine": augmenters.Affine, "resize": augmenters.Resize, "crop": augmenters.Crop,
+             "crop_to_fix_size": augmenters.CropToFixedSize, "pad_to_fix_size": augmenters.PadToFixedSize,
+             "horizontal_flip": augmenters.Fliplr, "vertical_flip": augmenters.Flipud}
+# Modules of imgaug whose augmenters move the pixels, meta contains Sequential, Sometimes, etc.
+SPATIAL_MODULES = ("imgaug.augmenters.geometric", "imgaug.augmenters.size", "imgaug.augmenters.flip",
+                   "imgaug.augmenters.meta")
+
+
+def translation(x, y):
+    return np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], dtype=np.float64)
+
+
+def scaling(x, y):
+    return np.array([[x, 0, 0], [0, y, 0], [0, 0, 1]], dtype=np.float64)
+
+
+class Warp(object):
+    def __init__(self, shape, cval=0):
+        """
+        Matrix from the input image to the output image in pixel coordinates,
+        where (0, 0) is the center of the top-left pixel.
+        :param shape: shape of the input image
+        :param cval: value of the pixels outside of the input image
+        """
+        self.input_shape = tuple(shape[:2])
+        self.height, self.width = shape[:2]
+        self.matrix = np.eye(3, dtype=np.float64)
+        self.cval = cval
+
+    def then(self, matrix, height=None, width=None):
+        self.matrix = matrix @ self.matrix
+        if height is not None:
+            self.height, self.width = int(height), int(width)
+        return self
+
+    def affine_matrix(self, scale_x=1.0, scale_y=1.0, rotate=0.0, shear=0.0, translate_x=0.0, translate_y=0.0):
+        """
+        The same as imgaug.augmenters.Affine, angles in degrees and translation in pixels,
+        the transform is centered at the current output
+        """
+        rotate, shear = math.radians(rotate), math.radians(shear)
+        # rotation @ shear @ scale, as skimage.transform.AffineTransform used by imgaug
+        rotation = np.array([[math.cos(rotate), -math.sin(rotate)], [math.sin(rotate), math.cos(rotate)]])
+        linear = rotation @ np.array([[1, -math.tan(shear)], [0, 1]]) @ np.diag([scale_x, scale_y])
+        matrix = np.eye(3, dtype=np.float64)
+        matrix[:2, :2], matrix[:2, 2] = linear, (translate_x, translate_y)
+        center_x, center_y = self.width / 2 - 0.5, self.height / 2 - 0.5
+        return translation(center_x, center_y) @ matrix @ translation(-center_x, -center_y)
+
+    def affine(self, **params):
+        return self.then(self.affine_matrix(**params))
+
+    def rotate_to_fit(self, angle):
+        """
+        Rotate and enlarge the output to contain the whole image,
+        the same as imgaug.augmenters.Affine(rotate=angle, fit_output=True)
+        """
+        matrix = self.affine_matrix(rotate=angle)
+        corners = np.array([[0, 0, 1], [0, self.height - 1, 1], [self.width - 1, self.height - 1, 1],
+                            [self.width - 1, 0, 1]], dtype=np.float64) @ matrix.T
+        low, high = corners[:, :2].min(axis=0), corners[:, :2].max(axis=0)
+        width, height = np.ceil(high - low + 1)
+        return self.then(translation(-low[0], -low[1]) @ matrix, height, width)
+
+    def crop(self, top, right, bottom, left):
+        return self.then(translation(-left, -top), self.height - top - bottom, self.width - left - right)
+
+    def pad(self, top, right, bottom, left):
+        return self.then(translation(left, top), self.height + top + bottom, self.width + left + right)
+
+    def flip_horizontal(self):
+        return self.then(np.array([[-1, 0, self.width - 1], [0, 1, 0], [0, 0, 1]], dtype=np.float64))
+
+    def flip_vertical(self):
+        return self.then(np.array([[1, 0, 0], [0, -1, self.height - 1], [0, 0, 1]], dtype=np.float64))
+
+    def resize(self, height, width):
+        height, width = int(height), int(width)
+        scale_x, scale_y = width / self.width, height / self.height
+        # Pixel centers: x' + 0.5 = (x + 0.5) * scale
+        matrix = translation(-0.5, -0.5) @ scaling(scale_x, scale_y) @ translation(0.5, 0.5)
+        return self.then(matrix, height, width)
+
+    def is_identity(self):
+        return (self.height, self.width) == self.input_shape and np.allclose(self.matrix, np.eye(3))
+
+    def apply(self, image):
+        if self.is_identity():
+            return image
+        channels = 1 if len(image.shape) == 2 else image.shape[2]
+        output = cv2.warpAffine(image, self.matrix[:2], (self.width, self.height), flags=cv2.INTER_LINEAR,
+                                borderMode=cv2.BORDER_CONSTANT, borderValue=(self.cval,) * 4)
+        if len(output.shape) == 2 and channels == 1 and len(image.shape) == 3:
+            output = np.expand_dims(output, axis=-1)
+        return output
+
+    def apply_bbox(self, bbox):
+        """
+        :param bbox: array in shape of (N, 4), (x1, y1, x2, y2) in pixels
+        :return: the axis-aligned boxes containing the transformed boxes
+        """
+        if len(bbox) == 0:
+            return bbox
+        # Boxes are in continuous coordinates, where (0, 0) is the top-left corner of the image
+        x1, y1, x2, y2 = bbox[:, 0] - 0.5, bbox[:, 1] - 0.5, bbox[:, 2] - 0.5, bbox[:, 3] - 0.5
+        # (N, 4 corners, 2)
+        corners = np.stack([np.stack([x1, y1], -1), np.stack([x2, y1], -1),
+                            np.stack([x1, y2], -1), np.stack([x2, y2], -1)], 1)
+        corners = corners @ self.matrix[:2, :2].T + self.matrix[:2, 2] + 0.5
+        return np.concatenate([corners.min(axis=1), corners.max(axis=1)], axis=1).astype(np.float32)
+
+
+def sample(rng, value):
+    """
+    :param value: a number, or a range (low, high) to sample from uniformly
+    """
+    if type(value) is tuple or type(value) is list:
+        return rng.uniform(value[0], value[1])
+    return value
+
+
+def folded_augmenters(rand_aug):
+    """
+    The augmenters of rand_aug which are folded into the warp: the geometric ones created by
+    prepare_augmentation, until another augmenter which moves the pixels (e.g. a Fliplr built by
+    the user). That one and the following are left to imgaug, so the order is kept.
+    The others (color, blur, ...) are still run by imgaug after the warp.
+    """
+    folded = []
+    for augmenter in (rand_aug if rand_aug else []):
+        if type(augmenter) is GEOMETRIC.get(augmenter.name):
+            folded.append(augmenter)
+        elif type(augmenter).__module__ in SPATIAL_MODULES:
+            break
+    return folded
+
+
+def strip_geometric(rand_aug):
+    """
+    :return: augmenters in rand_aug which are not folded into the warp
+    """
+    if rand_aug is None:
+        return None
+    folded = folded_augmenters(rand_aug)
+    return [augmenter for augmenter in rand_aug if not any([augmenter is _ for _ in folded])]
+
+
+def plan_warp(args, shape, rand_aug=None, det_info=None, size=None, seed=None):
+    """
+    Sample the geometric augmentations of one image and compose them into a Warp.
+    Parameters of the random augmentations are read from args like augmentation.prepare_augmentation
+    does, for each augmenter returned by folded_augmenters(rand_aug), in their order.
+
+    :param shape: shape of the image
+    :param rand_aug: list of imgaug augmenters
+    :param det_info: the information returned by pre_process, see augmentation.prepare_deterministic_augmentation
+    :param size: (height, width) of the output, None means keep the size after augmentation
+    :param seed: all the random parameters are decided by the seed
+    :return: Warp
+    """
+    rng = np.random.RandomState(None if seed is None else seed % (2 ** 32))
+    warp = Warp(shape, args.aug_bg_color)
+    if det_info:
+        if "rotation" in det_info:
+            warp.rotate_to_fit(det_info["rotation"])
+        if "crop" in det_info:
+            warp.crop(*det_info["crop"])
+    for augmenter in folded_augmenters(rand_aug):
+        if isinstance(augmenter, augmenters.Affine):
+            warp.affine(scale_x=sample(rng, args.scale_x), scale_y=sample(rng, args.scale_y),
+                        rotate=sample(rng, args.rotation), shear=sample(rng, args.shear),
+                        translate_x=sample(rng, args.translation_x) * warp.width,
+                        translate_y=sample(rng, args.translation_y) * warp.height)
+        elif isinstance(augmenter, augmenters.Resize):
+            warp.resize(*resize_size(rng, args.resize_size, warp.height, warp.width))
+        elif isinstance(augmenter, augmenters.CropToFixedSize):
+            height, width = args.crop_size
+            top = int(rng.uniform() * max(warp.height - height, 0))
+            left = int(rng.uniform() * max(warp.width - width, 0))
+            warp.crop(top, max(warp.width - width - left, 0), max(warp.height - height - top, 0), left)
+        elif isinstance(augmenter, augmenters.Crop):
+            height, width = warp.height, warp.width
+            warp.crop(*crop_amounts(rng, args, height, width))
+            # Crop keeps the size of image by default
+            warp.resize(height, width)
+        elif isinstance(augmenter, augmenters.PadToFixedSize):
+            height, width = args.padding_size[0] if type(args.padding_size[0]) in (tuple, list) \
+                else args.padding_size
+            if args.padding_position == "uniform":
+                x, y = rng.uniform(), rng.uniform()
+            else:
+                x, y = args.padding_position
+            pad_x, pad_y = max(width - warp.width, 0), max(height - warp.height, 0)
+            left, top = int((1 - x) * pad_x), int((1 - y) * pad_y)
+            warp.pad(top, pad_x - left, pad_y - top, left)
+        elif isinstance(augmenter, augmenters.Fliplr):
+            if rng.uniform() < args.h_flip_prob:
+                warp.flip_horizontal()
+        elif isinstance(augmenter, augmenters.Flipud):
+            if rng.uniform() < args.v_flip_prob:
+                warp.flip_vertical()
+    if size is not None:
+        warp.resize(size[0], size[1])
+    return warp
+
+
+def resize_size(rng, value, height, width):
+    """
+    :param value: args.resize_size, a number or a range of numbers applied to both sides,
+            or a dict of "height" and "width". Integers are pixels and floats are fractions.
+    """
+    if type(value) is dict:
+        value_h, value_w = sample(rng, value["height"]), sample(rng, value["width"])
+    else:
+        value_h = value_w = sample(rng, value)
+    return [int(round(v * side)) if isinstance(v, float) else int(v)
+            for v, side in ((value_h, height), (value_w, width))]
+
+
+def crop_amounts(rng, args, height, width):
+    """
+    The same as augmenters.Crop(px=args.crop_pixel, percent=args.crop_percent,
+    sample_independently=args.crop_samp_indp)
+    :return: (top, right, bottom, left) in pixels
+    """
+    percent = args.crop_pixel is None or len(args.crop_pixel) == 0
+    value = tuple(args.crop_percent) if percent else tuple(args.crop_pixel)
+    if len(value) == 4:
+        amounts = [sample(rng, v) for v in value]
+    elif args.crop_samp_indp:
+        amounts = [sample(rng, value) for _ in range(4)]
+    else:
+        amounts = [sample(rng, value)] * 4
+    if percent:
+        sides = (height, width, height, width)
+        return [int(round(a * side)) for a, side in zip(amounts, sides)]
+    return [int(round(a)) for a in amounts]
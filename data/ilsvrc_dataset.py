@@ -15,33 +15,105 @@
 
 """
 
-import os
-import omni_torch.data.misc as misc
+import os, json, hashlib, warnings
+import numpy as np
+import omni_torch.data.path_loader as path_loader
+import omni_torch.data.index_cache as index_cache
+from omni_torch.data.storage import Packed_Strings, Column_Dataset, save_array, writable_cache_dir
 from omni_torch.data.arbitrary_dataset import Arbitrary_Dataset
 import omni_torch.data as data
 
 
-# Todo: Not Tested Yet
-
 class ILSVRC_Dataset(Arbitrary_Dataset):
-    def __init__(self, args, sources, step_1, step_2, auxiliary_info, pre_process=None, **options):
-        super().__init__(args, sources, step_1, step_2, auxiliary_info, pre_process, options)
-        
+    def __init__(self, args, sources, step_1, step_2, auxiliary_info=None, pre_process=None, **options):
+        """
+        Images are stored in args.path/<class name>/<image>.
+        The index is a packed buffer of relative paths, an int32 label array and the class names,
+        saved as sidecar files (in args.index_cache_dir, or storage.DEFAULT_CACHE_DIR) and loaded by mmap,
+        so neither the startup nor the memory of DataLoader workers depends on the number of images.
+        When the sidecar files cannot be written, the index is kept in memory.
+        Each sample is [path, label].
+        """
+        super().__init__(args, sources, step_1, step_2, pre_process=pre_process,
+                         auxiliary_info=auxiliary_info, **options)
+
     def prepare(self):
         self.dataset = self.load_dataset()
-    
-    def load_dataset(self):
+        print("Number of samples in dataset is: %s" % (len(self.dataset)))
+
+    def index_prefix(self, path):
         """
-        :return: a dataset in the form of dict {'A':[...], 'B':[...], ...}
+        :return: prefix of the sidecar files, None if they cannot be written
         """
-        dataset = {}
-        path = os.path.expanduser(self.args.path)
-        classes = os.listdir(path)
-        classes = [cls for cls in classes if os.path.isdir(os.path.join(path, cls))]
+        cache_dir = writable_cache_dir(self.args)
+        if cache_dir is None:
+            return None
+        return os.path.join(cache_dir, "ilsvrc_%s" % hashlib.sha1(path.encode("utf-8")).hexdigest()[:16])
+
+    def build_index(self, path):
+        classes = sorted([entry.name for entry in os.scandir(path)
+                          if entry.is_dir() and not entry.name.startswith(".")])
+        extensions = frozenset(self.args.extensions) if self.args.extensions else None
+        names, counts = [], []
         for i, cls in enumerate(classes):
             if self.verbose:
                 print('Loading {}th {} class.'.format(i, cls))
-            dataset.update({cls: [_ for _ in os.listdir(os.path.join(path, cls)) if
-                                  misc.extension_check(_, self.args.extensions)]})
+            images = sorted([os.path.join(cls, os.path.basename(_)) for _ in
+                             path_loader.scan_folder(os.path.join(path, cls), extensions)])
+            names += images
+            counts.append(len(images))
+        labels = np.repeat(np.arange(len(classes), dtype=np.int32), counts)
+        return Packed_Strings.from_list(names), labels, classes
+
+    @staticmethod
+    def save_index(prefix, paths, labels, meta):
+        # The meta is written last, so it never describes the arrays being replaced
+        try:
+            os.remove(prefix + "_meta.json")
+        except FileNotFoundError:
+            pass
+        paths.save(prefix)
+        save_array(prefix + "_labels.npy", labels)
+        tmp_path = "%s_meta.json.%s.tmp" % (prefix, os.getpid())
+        with open(tmp_path, "w") as file:
+            json.dump(meta, file)
+        os.replace(tmp_path, prefix + "_meta.json")
+
+    def load_dataset(self):
+        """
+        :return: a Column_Dataset, each sample is [path, label]
+        """
+        path = os.path.expanduser(self.args.path)
+        prefix = self.index_prefix(path)
+        # The listing of root folder and class folders decide the index
+        mtimes = {}
+        for watched in index_cache.watched_paths(path, "", 1):
+            stat = os.stat(watched)
+            mtimes[watched] = [stat.st_mtime_ns, stat.st_size]
+        meta = {"extensions": sorted(self.args.extensions) if self.args.extensions else None, "mtimes": mtimes}
+        cached = None
+        if prefix is not None and os.path.exists(prefix + "_meta.json") and Packed_Strings.exists(prefix) \
+                and os.path.exists(prefix + "_labels.npy"):
+            with open(prefix + "_meta.json", "r") as file:
+                cached = json.load(file)
+        if cached is not None and cached["extensions"] == meta["extensions"] and cached["mtimes"] == meta["mtimes"]:
+            print("Load ILSVRC index from: %s" % prefix)
+            classes = cached["classes"]
+        else:
+            paths, labels, classes = self.build_index(path)
+            if prefix is not None:
+                try:
+                    self.save_index(prefix, paths, labels, dict(meta, classes=classes))
+                except OSError as e:
+                    warnings.warn("Cannot write the ILSVRC index to %s (%s), it is kept in memory." % (prefix, e))
+                    prefix = None
+            if prefix is None:
+                paths.prefix = os.path.join(path, "")
+                self.paths, self.labels = paths, labels
+        self.classes = classes
+        self.class_to_idx = {cls: i for i, cls in enumerate(classes)}
+        if prefix is not None:
+            self.paths = Packed_Strings.load(prefix, prefix=os.path.join(path, ""))
+            self.labels = np.load(prefix + "_labels.npy", mmap_mode="r")
         print("Dataset loading is complete.")
-        return dataset
\ No newline at end of file
+        return Column_Dataset([self.paths, self.labels])
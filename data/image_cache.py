@@ -0,0 +1,243 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import atexit, hashlib
+import multiprocessing as mpi
+from collections import OrderedDict
+import numpy as np
+
+
+class LRU_Image_Cache(object):
+    def __init__(self, max_bytes):
+        """
+        Keep decoded images in memory, the least recently used images are evicted
+        when the total size exceeds max_bytes.
+        :param max_bytes: memory budget in bytes
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.images = OrderedDict()
+
+    def get(self, key):
+        image = self.images.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.images.move_to_end(key)
+        return image
+
+    def put(self, key, image):
+        if image.nbytes > self.max_bytes or key in self.images:
+            return
+        self.images[key] = image
+        self.nbytes += image.nbytes
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.images.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        self.images.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "images": len(self.images),
+                "bytes": self.nbytes, "max_bytes": self.max_bytes}
+
+
+class Shared_Image_Cache(object):
+    # Supported dtypes of images, the position in this list is stored in the index
+    DTYPES = [np.uint8, np.uint16, np.int16, np.int32, np.float32, np.float64]
+    EMPTY, WRITING, READY = 0, 1, 2
+    # Nothing is inserted above this fraction of used slots, and a key is looked up
+    # in at most MAX_PROBES slots, so a miss never scans the whole table
+    LOAD_FACTOR = 0.7
+    MAX_PROBES = 32
+    ENTRY = np.dtype([("key", np.uint64), ("offset", np.uint64), ("nbytes", np.uint64),
+                      ("shape", np.int32, (3,)), ("ndim", np.uint8), ("dtype", np.uint8),
+                      ("state", np.uint8)], align=True)
+
+    def __init__(self, max_bytes, slots=None, context=None):
+        """
+        A cache of decoded images in shared memory, all the DataLoader workers read
+        from and write to the same arena, so each image is decoded once per host.
+        Images are appended to the arena and never evicted, when the arena is full
+        new images are just not cached. An open addressing hash table in another
+        shared memory block maps the image to its position in the arena.
+        Create it in the main process before the DataLoader starts its workers.
+        :param max_bytes: size of the arena in bytes
+        :param slots: size of the hash table, see table_slots
+        :param context: start method of the DataLoader workers, i.e. its multiprocessing_context,
+                None means the default start method. The lock can only be shared with
+                the processes started by the same method.
+        """
+        from multiprocessing import shared_memory
+        self.max_bytes = max_bytes
+        self.slots = slots if slots else self.table_slots(max_bytes)
+        self.arena = shared_memory.SharedMemory(create=True, size=max_bytes)
+        self.table = shared_memory.SharedMemory(create=True, size=self.slots * self.ENTRY.itemsize)
+        self.index = np.ndarray((self.slots,), dtype=self.ENTRY, buffer=self.table.buf)
+        self.index[:] = np.zeros(1, dtype=self.ENTRY)
+        # Bytes used in the arena, its lock also protects the slot allocation
+        self.used = mpi.get_context(context).Value("Q", 0)
+        self.entries = mpi.get_context(context).RawValue("Q", 0)
+        self.hits = 0
+        self.misses = 0
+        self.owner = True
+        atexit.register(self.close)
+        install(self)
+
+    def __getstate__(self):
+        return {"max_bytes": self.max_bytes, "slots": self.slots, "used": self.used, "entries": self.entries,
+                "arena": self.arena.name, "table": self.table.name}
+
+    def __setstate__(self, state):
+        # Invoked in the DataLoader workers started by spawn
+        self.max_bytes = state["max_bytes"]
+        self.slots = state["slots"]
+        self.used = state["used"]
+        self.entries = state["entries"]
+        self.arena = self.attach(state["arena"])
+        self.table = self.attach(state["table"])
+        self.index = np.ndarray((self.slots,), dtype=self.ENTRY, buffer=self.table.buf)
+        self.hits = 0
+        self.misses = 0
+        self.owner = False
+        install(self)
+
+    @classmethod
+    def table_slots(cls, max_bytes, images=None):
+        """
+        :param images: expected number of images, e.g. the number of images in the dataset,
+                None means every image takes 16 KB of the arena
+        :return: size of the hash table which holds all of them under LOAD_FACTOR
+        """
+        # Smaller images than 1 KB are not expected, which bounds the size of the table
+        images = max_bytes // 16384 if images is None else min(images, max_bytes // 1024)
+        return max(1024, int(images / cls.LOAD_FACTOR) + 1)
+
+    @staticmethod
+    def attach(name):
+        from multiprocessing import shared_memory
+        try:
+            # The memory belongs to the main process, workers should never unlink it
+            return shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Before python 3.13, workers share the resource tracker of the main process,
+            # registering the same name twice is harmless
+            return shared_memory.SharedMemory(name=name)
+
+    @staticmethod
+    def hash(key):
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=8).digest()
+        # 0 is reserved for empty slots
+        return max(int.from_bytes(digest, "little"), 1)
+
+    def get(self, key):
+        h = self.hash(key)
+        for probe in range(min(self.MAX_PROBES, self.slots)):
+            entry = self.index[(h + probe) % self.slots]
+            if entry["key"] == 0:
+                break
+            if entry["key"] == h:
+                if entry["state"] != self.READY:
+                    break
+                self.hits += 1
+                return np.ndarray(tuple(entry["shape"][:entry["ndim"]]), dtype=self.DTYPES[entry["dtype"]],
+                                  buffer=self.arena.buf, offset=int(entry["offset"]))
+        self.misses += 1
+        return None
+
+    def put(self, key, image):
+        if image.dtype.type not in self.DTYPES or image.ndim > 3:
+            return
+        image = np.ascontiguousarray(image)
+        h = self.hash(key)
+        with self.used.get_lock():
+            if self.entries.value >= self.LOAD_FACTOR * self.slots:
+                return
+            for probe in range(min(self.MAX_PROBES, self.slots)):
+                slot = (h + probe) % self.slots
+                if self.index[slot]["key"] == h:
+                    return
+                if self.index[slot]["key"] == 0:
+                    break
+            else:
+                return
+            # Keep each image aligned to 64 bytes
+            offset = (self.used.value + 63) // 64 * 64
+            if offset + image.nbytes > self.max_bytes:
+                return
+            self.used.value = offset + image.nbytes
+            self.entries.value += 1
+            shape = list(image.shape) + [0] * (3 - image.ndim)
+            self.index[slot] = (h, offset, image.nbytes, shape, image.ndim,
+                                self.DTYPES.index(image.dtype.type), self.WRITING)
+        # Copy outside of the lock, readers ignore the entry until it is ready
+        np.ndarray(image.shape, dtype=image.dtype, buffer=self.arena.buf, offset=offset)[:] = image
+        self.index[slot]["state"] = self.READY
+
+    def close(self):
+        global _shared
+        if self.index is None:
+            return
+        self.index = None
+        if _shared is self:
+            _shared = None
+        self.arena.close()
+        self.table.close()
+        if self.owner:
+            self.arena.unlink()
+            self.table.unlink()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes": self.used.value,
+                "max_bytes": self.max_bytes, "images": self.entries.value, "slots": self.slots}
+
+
+# Every process (e.g. each DataLoader worker) has its own cache
+_cache = None
+# Unless a cache in shared memory is installed
+_shared = None
+
+
+def install(cache):
+    global _shared
+    _shared = cache
+
+
+def get_cache(args):
+    """
+    :return: the cache of this process, None if args.img_cache_bytes is 0
+            and no shared cache is installed
+    """
+    global _cache
+    if _shared is not None:
+        return _shared
+    if not args.img_cache_bytes:
+        return None
+    if _cache is None or _cache.max_bytes != args.img_cache_bytes:
+        _cache = LRU_Image_Cache(args.img_cache_bytes)
+    return _cache
+
+
+def stats():
+    if _shared is not None:
+        return _shared.stats()
+    return None if _cache is None else _cache.stats()
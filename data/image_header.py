@@ -0,0 +1,216 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import struct
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+"""
+Read the size of images from their headers without decoding the pixels.
+Each reader returns (height, width, channels, bit_depth), or None when the
+header cannot be understood.
+"""
+
+JPEG, PNG, TIFF = "jpeg", "png", "tiff"
+
+# Increase this number whenever scan() changes its result, the headers cached by
+# Arbitrary_Dataset.prescan are then read again
+SCAN_VERSION = 2
+
+
+def image_format(head):
+    if head[:3] == b"\xff\xd8\xff":
+        return JPEG
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return PNG
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return TIFF
+    return None
+
+
+def read_jpeg(file):
+    file.seek(2)
+    while True:
+        marker = file.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # Skip fill bytes
+        while marker[1] == 0xFF:
+            marker = marker[1:] + file.read(1)
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            # Markers without payload
+            continue
+        length = file.read(2)
+        if len(length) < 2:
+            return None
+        length = struct.unpack(">H", length)[0]
+        # Start Of Frame markers, except DHT(C4), JPG(C8) and DAC(CC)
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            payload = file.read(6)
+            if len(payload) < 6:
+                return None
+            bit_depth, height, width, channels = struct.unpack(">BHHB", payload)
+            return height, width, channels, bit_depth
+        file.seek(length - 2, 1)
+
+
+def read_png(file):
+    file.seek(8)
+    chunk = file.read(8 + 13)
+    if len(chunk) < 21 or chunk[4:8] != b"IHDR":
+        return None
+    width, height, bit_depth, color_type = struct.unpack(">IIBB", chunk[8:18])
+    # 0: gray, 2: RGB, 3: palette, 4: gray + alpha, 6: RGB + alpha
+    channels = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}.get(color_type)
+    if channels is None:
+        return None
+    if color_type == 3:
+        # Palette images are decoded as 8-bit
+        bit_depth = 8
+    return height, width, channels, bit_depth
+
+
+def read_tiff(file):
+    """
+    Read the first IFD (image file directory) of a TIFF file
+    """
+    file.seek(0)
+    head = file.read(8)
+    order = "<" if head[:2] == b"II" else ">"
+    file.seek(struct.unpack(order + "I", head[4:8])[0])
+    count = struct.unpack(order + "H", file.read(2))[0]
+    entries = file.read(12 * count)
+    tags = {}
+    for i in range(count):
+        tag, type, number, value = struct.unpack(order + "HHI4s", entries[12 * i: 12 * i + 12])
+        if type == 3:
+            # SHORT, more than 2 values do not fit in the entry, thus the entry is an offset
+            if number > 2:
+                position = file.tell()
+                file.seek(struct.unpack(order + "I", value)[0])
+                value = file.read(2)
+                file.seek(position)
+            tags[tag] = struct.unpack(order + "H", value[:2])[0]
+        elif type == 4:
+            # LONG
+            tags[tag] = struct.unpack(order + "I", value)[0]
+    # ImageWidth, ImageLength, SamplesPerPixel and BitsPerSample
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[257], tags[256], tags.get(277, 1), tags.get(258, 1)
+
+
+READERS = {JPEG: read_jpeg, PNG: read_png, TIFF: read_tiff}
+
+# The last bytes of a complete file, a truncated file does not end with them
+ENDINGS = {JPEG: b"\xff\xd9", PNG: b"IEND"}
+
+
+def probe(path):
+    """
+    :return: format of the image and its header (height, width, channels, bit_depth),
+            either of them can be None
+    """
+    try:
+        with open(path, "rb") as file:
+            format = image_format(file.read(8))
+            reader = READERS.get(format)
+            if reader is None:
+                return format, None
+            return format, reader(file)
+    except (OSError, struct.error):
+        return None, None
+
+
+def read_header(path):
+    """
+    :return: (height, width, channels, bit_depth) or None
+    """
+    return probe(path)[1]
+
+
+def decode_header(path):
+    """
+    Decode the image by cv2 to get its header, for the formats without a reader, e.g. BMP, WebP and GIF
+    :return: (height, width, channels, bit_depth) or None if cv2 cannot decode it
+    """
+    try:
+        image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    except cv2.error:
+        return None
+    if image is None:
+        return None
+    channels = image.shape[2] if len(image.shape) == 3 else 1
+    return image.shape[0], image.shape[1], channels, image.dtype.itemsize * 8
+
+
+def is_complete(path, format):
+    """
+    Check whether the file is truncated by the end marker of its format,
+    formats without ENDINGS are always complete
+    """
+    ending = ENDINGS.get(format)
+    if ending is None:
+        return True
+    try:
+        with open(path, "rb") as file:
+            file.seek(0, 2)
+            file.seek(max(file.tell() - 32, 0))
+            if ending in file.read():
+                return True
+            # Data appended after the end marker is common (e.g. written by cameras and editors),
+            # so the whole file is searched before treating it as truncated
+            file.seek(0)
+            return ending in file.read()
+    except OSError:
+        return False
+
+
+def scan(paths, check_ending=True):
+    """
+    :return: int32 array in shape of (len(paths), 4), each row is (height, width, channels, bit_depth),
+            or -1 when the file is not readable
+    """
+    headers = np.full((len(paths), 4), -1, dtype=np.int32)
+    for i, path in enumerate(paths):
+        format, header = probe(path)
+        if header is None:
+            header = decode_header(path)
+        elif check_ending and not is_complete(path, format):
+            header = None
+        if header is not None:
+            headers[i] = header
+    return headers
+
+
+def scan_headers(paths, threads=8, chunk_size=1024, check_ending=True):
+    """
+    Read the headers of JPEG, PNG and TIFF images in parallel without decoding them,
+    images of the other formats are decoded by cv2.
+    :param paths: a list or anything supports len() and indexing, e.g. storage.Packed_Strings
+    :param threads: number of threads, opening the files is blocked by IO
+    :param check_ending: also treat the truncated JPEG and PNG files as unreadable
+    :return: int32 array in shape of (len(paths), 4), see scan()
+    """
+    chunks = [[paths[j] for j in range(i, min(i + chunk_size, len(paths)))]
+              for i in range(0, len(paths), chunk_size)]
+    if len(chunks) == 0:
+        return np.zeros((0, 4), dtype=np.int32)
+    with ThreadPoolExecutor(max(threads, 1)) as executor:
+        return np.concatenate(list(executor.map(lambda chunk: scan(chunk, check_ending), chunks)))
@@ -15,21 +15,57 @@
 
 """
 
-import os
+import os, warnings
 import omni_torch.data.misc as misc
+import omni_torch.data.path_loader as path_loader
 from omni_torch.data.arbitrary_dataset import Arbitrary_Dataset
 import omni_torch.data as data
 
 
 class Img2Img_Dataset(Arbitrary_Dataset):
     def __init__(self, args, sources, step_1, step_2, pre_process=None, auxiliary_info=None,
-                 augmentaion=None, one_to_one=True, **options):
+                 augmentaion=None, one_to_one=True, pair_by=None, **options):
+        """
+        :param one_to_one: pair the sorted source and target images by their position
+        :param pair_by: pair source and target images by a key of their file name instead,
+                "stem" means the file name without extension, or a function maps a file name to its key.
+                Images without partner are reported and stored in self.unmatched.
+        """
         assert len(sources) is 2, "In img2img dataset only two sources are allowed."
         assert len(step_1) is 2, "In img2img dataset only two sources are allowed."
         assert len(step_2) is 2, "In img2img dataset only two sources are allowed."
-        super().__init__(args, sources, step_1, step_2, pre_process, auxiliary_info,
-                         augmentaion, **options)
+        super().__init__(args, sources, step_1, step_2, pre_process=pre_process,
+                         auxiliary_info=auxiliary_info, augmentation=augmentaion, **options)
         self.one_to_one = one_to_one
+        self.pair_by = pair_by
+        self.unmatched = {"source": [], "target": []}
+
+    def pair_by_key(self, source_imgs, target_imgs):
+        """
+        Join source and target images on their keys with a dict, linear to the number of images
+        """
+        key = self.pair_by if callable(self.pair_by) else lambda name: os.path.splitext(name)[0]
+        targets = {}
+        for target_img in target_imgs:
+            k = key(os.path.basename(target_img))
+            if k in targets:
+                # Only the first image of a key is paired, the others are reported
+                self.unmatched["target"].append(target_img)
+            else:
+                targets[k] = target_img
+        dataset = []
+        for source_img in source_imgs:
+            target_img = targets.pop(key(os.path.basename(source_img)), None)
+            if target_img is None:
+                self.unmatched["source"].append(source_img)
+            else:
+                dataset.append([source_img, target_img])
+        self.unmatched["target"] += list(targets.values())
+        if self.unmatched["source"] or self.unmatched["target"]:
+            warnings.warn("%s source images and %s target images are not paired, see self.unmatched. e.g. %s"
+                          % (len(self.unmatched["source"]), len(self.unmatched["target"]),
+                             (self.unmatched["source"] + self.unmatched["target"])[:3]))
+        return dataset
 
     def load_dataset(self):
         A_B_folder = self.sources
@@ -39,10 +75,16 @@ class Img2Img_Dataset(Arbitrary_Dataset):
         source = os.path.join(path, A_B_folder[0])
         target = os.path.join(path, A_B_folder[1])
         assert os.path.isdir(source) and os.path.isdir(target), "one of the folder does not exist."
-        source_imgs = [os.path.join(path, A_B_folder[0], _) for _ in os.listdir(source)
-                       if misc.extension_check(_, self.args.extensions)]
-        target_imgs = [os.path.join(path, A_B_folder[1], _) for _ in os.listdir(target)
-                       if misc.extension_check(_, self.args.extensions)]
+        extensions = frozenset(self.args.extensions) if self.args.extensions else None
+        source_imgs = path_loader.scan_folder(source, extensions)
+        target_imgs = path_loader.scan_folder(target, extensions)
+        if self.pair_by:
+            self.unmatched = {"source": [], "target": []}
+            source_imgs.sort()
+            target_imgs.sort()
+            dataset = self.pair_by_key(source_imgs, target_imgs)
+            print('Dataset loading is complete.')
+            return dataset
         if self.one_to_one:
             assert len(source_imgs) == len(target_imgs)
             if self.verbose: print("Sorting files...")
@@ -59,4 +101,4 @@ class Img2Img_Dataset(Arbitrary_Dataset):
                 print("{} samples has been loaded...".format(i))
             dataset.append([source_imgs[i], target_imgs[i]])
         print('Dataset loading is complete.')
-        return dataset
\ No newline at end of file
+        return dataset
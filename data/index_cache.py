@@ -0,0 +1,250 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os, json, pickle, struct, hashlib
+import numpy as np
+import omni_torch.data.storage as storage
+
+# Increase this number whenever the layout of the cache file changes
+CACHE_VERSION = 2
+MAGIC = b"OMTHIDX1"
+
+
+def callable_name(func):
+    """
+    A stable identity of step_1 functions, it will not change between runs
+    while the id() of the function does.
+    """
+    if callable(func):
+        module = getattr(func, "__module__", None)
+        name = getattr(func, "__qualname__", None) or getattr(func, "__name__", None)
+        if module and name:
+            return "%s.%s" % (module, name)
+    return repr(func)
+
+
+def watched_paths(path, source, dig_level, leaf_only=False):
+    """
+    Return the folders (or files) whose modification time decides the result of step_1.
+    When dig_level is n, the listing of folders from level 0 to level n are read by
+    step_1, so their mtime is what we need to watch.
+    :param leaf_only: only return the folders on level n, which contain the files
+    """
+    if type(source) is str:
+        roots = [os.path.join(path, source)]
+    elif type(source) is tuple or type(source) is list:
+        roots = [os.path.join(path, _) for _ in source]
+    else:
+        raise TypeError
+    dig_level = dig_level if type(dig_level) is int else 0
+    watched = []
+    for root in roots:
+        if not os.path.isdir(root):
+            watched.append(root)
+            continue
+        current_folders = [root]
+        for level in range(dig_level + 1):
+            if not leaf_only or level == dig_level:
+                watched += current_folders
+            if level == dig_level:
+                break
+            sub_folders = []
+            for folder in current_folders:
+                with os.scandir(folder) as entries:
+                    sub_folders += [entry.path for entry in entries
+                                    if not entry.name.startswith(".") and entry.is_dir()]
+            current_folders = sub_folders
+    return watched
+
+
+def watched_mtimes(dataset, leaf_only=False):
+    """
+    :return: a dict of watched path: [mtime in ns, size], None if it does not exist
+    """
+    path = os.path.expanduser(dataset.args.path)
+    mtimes = {}
+    for i, source in enumerate(dataset.sources):
+        for watched in watched_paths(path, source, dataset.auxiliary[i], leaf_only):
+            try:
+                stat = os.stat(watched)
+                mtimes[watched] = [stat.st_mtime_ns, stat.st_size]
+            except FileNotFoundError:
+                mtimes[watched] = None
+    return mtimes
+
+
+def cache_key(dataset):
+    """
+    :param dataset: an Arbitrary_Dataset (or its subclass) instance
+    :return: a dict describing everything the result of dataset.load_dataset() depends on
+    """
+    args = dataset.args
+    path = os.path.expanduser(args.path)
+    mtimes = watched_mtimes(dataset)
+    return {
+        "version": CACHE_VERSION,
+        "class": callable_name(type(dataset)),
+        "path": path,
+        "sources": [list(_) if type(_) is tuple else _ for _ in dataset.sources],
+        "step_1": [callable_name(_) for _ in dataset.step_1],
+        "auxiliary": [repr(_) for _ in dataset.auxiliary],
+        "extensions": sorted(args.extensions) if args.extensions else None,
+        "mtimes": mtimes,
+    }
+
+
+def cache_path(args, key):
+    """
+    The file name only depends on where the data come from, so that a changed
+    extension list or modified folder will overwrite the stale cache instead of
+    leaving it on the disk.
+    """
+    identity = json.dumps([key["class"], key["path"], key["sources"], key["step_1"],
+                           key["auxiliary"]], sort_keys=True)
+    digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(os.path.expanduser(args.index_cache_dir), "index_%s.omth" % digest)
+
+
+def read_header(path):
+    with open(path, "rb") as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            return None
+        length = struct.unpack("<Q", file.read(8))[0]
+        return json.loads(file.read(length).decode("utf-8"))
+
+
+def explain(key, header):
+    """
+    :return: a list of reasons why the cached index cannot be used, empty if the cache is valid
+    """
+    if header is None:
+        return ["cache file does not exist or is corrupted"]
+    reasons = []
+    for field in ["version", "class", "path", "sources", "step_1", "auxiliary", "extensions"]:
+        if key[field] != header.get(field):
+            reasons.append("%s changed from %s to %s" % (field, header.get(field), key[field]))
+    old, new = header.get("mtimes", {}), key["mtimes"]
+    for watched in sorted(set(old) | set(new)):
+        if watched not in old:
+            reasons.append("%s is new" % watched)
+        elif watched not in new:
+            reasons.append("%s was removed" % watched)
+        elif old[watched] != new[watched]:
+            reasons.append("%s was modified" % watched)
+    return reasons
+
+
+def save_column(prefix, column):
+    """
+    Write a column of storage.Column_Dataset into .npy files starting with prefix
+    :return: the layout of the column to be stored in the header
+    """
+    if isinstance(column, storage.Packed_Strings):
+        column.save(prefix)
+        return {"kind": "strings", "prefix": column.prefix}
+    if isinstance(column, storage.Packed_Tuples):
+        return {"kind": "tuples", "columns": [save_column("%s_%d" % (prefix, i), _)
+                                              for i, _ in enumerate(column.columns)]}
+    if isinstance(column, np.ndarray) and column.dtype != object:
+        storage.save_array(prefix + ".npy", column)
+        return {"kind": "array"}
+    # Values which cannot be packed, e.g. dicts
+    tmp_path = "%s.pkl.%s.tmp" % (prefix, os.getpid())
+    with open(tmp_path, "wb") as file:
+        pickle.dump(list(column), file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, prefix + ".pkl")
+    return {"kind": "pickle"}
+
+
+def load_column(prefix, layout):
+    if layout["kind"] == "strings":
+        return storage.Packed_Strings.load(prefix, prefix=layout["prefix"])
+    if layout["kind"] == "tuples":
+        return storage.Packed_Tuples([load_column("%s_%d" % (prefix, i), _)
+                                      for i, _ in enumerate(layout["columns"])])
+    if layout["kind"] == "array":
+        return np.load(prefix + ".npy", mmap_mode="r")
+    with open(prefix + ".pkl", "rb") as file:
+        return pickle.load(file)
+
+
+def save(path, key, dataset):
+    """
+    The index is packed by storage.pack_dataset and each column is saved as .npy files
+    next to the cache file, which only holds the key and the layout of columns in JSON,
+    so the index is loaded by mmap without creating any Python object per item.
+    :param dataset: the result of storage.pack_dataset
+    """
+    prefix = path[:-len(".omth")] if path.endswith(".omth") else path
+    # The header is written last, it never describes the columns being replaced
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    if isinstance(dataset, storage.Column_Dataset):
+        columns = [save_column("%s_%d" % (prefix, i), _) for i, _ in enumerate(dataset.columns)]
+    else:
+        assert len(dataset) == 0, "the index should be packed by storage.pack_dataset"
+        columns = None
+    header = json.dumps(dict(key, columns=columns)).encode("utf-8")
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as file:
+        file.write(MAGIC)
+        file.write(struct.pack("<Q", len(header)))
+        file.write(header)
+    # Rename is atomic, other processes will never see a half-written cache
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    header = read_header(path)
+    if header["columns"] is None:
+        return []
+    prefix = path[:-len(".omth")] if path.endswith(".omth") else path
+    return storage.Column_Dataset([load_column("%s_%d" % (prefix, i), _) for i, _ in enumerate(header["columns"])])
+
+
+def load_or_build(dataset, rebuild=False):
+    """
+    Return the result of dataset.load_dataset() packed by storage.pack_dataset, read from
+    the on-disk cache in args.index_cache_dir when it is still valid, otherwise rebuild and save it.
+    :param dataset: an Arbitrary_Dataset (or its subclass) instance
+    :param rebuild: ignore the existing cache and rebuild it
+    """
+    args = dataset.args
+    cache_dir = os.path.expanduser(args.index_cache_dir)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    key = cache_key(dataset)
+    path = cache_path(args, key)
+    if rebuild:
+        reasons = ["rebuild was forced"]
+    else:
+        reasons = explain(key, read_header(path) if os.path.exists(path) else None)
+    # Keep the reasons so that users can check them after prepare()
+    dataset.index_cache_reasons = reasons
+    if not reasons:
+        print("Load dataset index from cache: %s" % path)
+        return load(path)
+    print("Index cache %s is invalidated because:" % path)
+    for reason in reasons[:10]:
+        print("    %s" % reason)
+    if len(reasons) > 10:
+        print("    ... and %s more" % (len(reasons) - 10))
+    result = storage.pack_dataset(dataset.load_dataset())
+    save(path, key, result)
+    return result
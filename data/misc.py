@@ -15,6 +15,7 @@
 
 """
 
+import random
 import numpy as np
 import warnings
 import omni_torch.data as data
@@ -45,10 +46,31 @@ def compliment_dim(input, dim):
         repeat = dim // len(input)
         if type(input) is list:
             input = input * repeat + input[:dim - len(input) * repeat]
-        elif type(input) is np.ndarray:
-            input = np.concatenate((np.tile(input, repeat), input[:dim - len(input) * repeat]))
+        elif isinstance(input, np.ndarray):
+            input = np.concatenate([input] * repeat + [input[:dim - len(input) * repeat]])
+        else:
+            # e.g. storage.Packed_Strings
+            input = [input[i % len(input)] for i in range(dim)]
         return input
     
+def shuffle_buffer(iterable, buffer_size, rng=None):
+    """
+    Shuffle a stream with a bounded buffer, memory usage does not grow with the stream.
+    :param rng: an instance of random.Random, use it to make the order reproducible
+    """
+    rng = random if rng is None else rng
+    buffer = []
+    for item in iterable:
+        if len(buffer) < buffer_size:
+            buffer.append(item)
+        else:
+            j = rng.randrange(buffer_size)
+            yield buffer[j]
+            buffer[j] = item
+    rng.shuffle(buffer)
+    for item in buffer:
+        yield item
+
 def str2bytes(str):
     return str.encode("ASCII")
 
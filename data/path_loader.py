@@ -15,20 +15,172 @@
 
 """
 
-import glob, pickle
+import os, glob, pickle, hashlib, itertools, warnings
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import omni_torch.data.misc as misc
+import omni_torch.data.storage as storage
 import numpy as np
 import omni_torch.data as data
 
 
-def load_path_from_csv(args, length, paths, dig_level=0):
+def load_path_from_csv(args, length, paths, columns=None):
+    """
+    Load a (multi-GB) manifest of csv/tsv format chunk by chunk, without one Python object per row.
+    :param paths: path of csv file, or a list of them which will be concatenated
+    :param columns: decide how the columns become data, either a list or a dict.
+            A list: each element is a column name, which becomes one element of the samples,
+                    or a list of column names, which becomes one float32 array in shape of
+                    (rows, len(names)), e.g. ["path", "label", ["x1", "y1", "x2", "y2"]].
+                    None means every column becomes an element.
+            A dict: {"columns": list above,
+                     "sep": separator, default is "\t" for .tsv files, otherwise ",",
+                     "chunksize": rows per chunk, default is 1000000,
+                     "root": folder prepended to the columns in "paths", relative to args.path,
+                     "paths": names of columns to prepend the root folder}
+    :return: a list of columns, numeric columns are numpy arrays while text columns are
+            storage.Packed_Strings. Whether a column is numeric is decided once from the first
+            rows, text columns are kept as they are (e.g. "NA" is not a missing value), and the
+            columns in "paths" must not be empty.
+    """
+    import pandas as pd
     if type(paths) is str:
         paths = [paths]
-    for path in paths:
-        with open(path, "r") as csv_file:
-            pass
+    options = columns if type(columns) is dict else {"columns": columns}
+    columns = options.get("columns")
+    chunksize = options.get("chunksize", 1000000)
+    usecols = None
+    if columns is not None:
+        usecols = list(itertools.chain.from_iterable([[_] if type(_) is str else _ for _ in columns]))
+    seps = [options.get("sep", "\t" if path.endswith(".tsv") else ",") for path in paths]
+    path_columns = options.get("paths", [])
+    # Decide the kind of each column once, so that every chunk agrees
+    head = pd.read_csv(paths[0], sep=seps[0], usecols=usecols, nrows=10000)
+    assert len(head) > 0, "%s is empty" % paths[0]
+    if columns is None:
+        columns = list(head.columns)
+    text = [_ for _ in columns if type(_) is str and
+            (_ in path_columns or not pd.api.types.is_numeric_dtype(head[_]))]
+    chunks = [[] for _ in columns]
+    for path, sep in zip(paths, seps):
+        # Converters bypass the detection of missing values, so the text is read as it is
+        for chunk in pd.read_csv(path, sep=sep, usecols=usecols, chunksize=chunksize,
+                                 converters={_: str for _ in text}):
+            for i, column in enumerate(columns):
+                if type(column) is not str:
+                    chunks[i].append(chunk[column].to_numpy(dtype=np.float32))
+                elif column not in text:
+                    if not pd.api.types.is_numeric_dtype(chunk[column]):
+                        raise ValueError("Column %s of %s is numeric in the first rows but contains text."
+                                         % (column, path))
+                    chunks[i].append(chunk[column].to_numpy())
+                else:
+                    values = chunk[column].tolist()
+                    if column in path_columns and "" in values:
+                        raise ValueError("Column %s of %s contains empty paths." % (column, path))
+                    chunks[i].append(storage.Packed_Strings.from_list(values))
+    root = options.get("root")
+    root = os.path.join(os.path.expanduser(args.path), root) if root is not None else None
+    output = []
+    for i, column in enumerate(columns):
+        if type(chunks[i][0]) is np.ndarray:
+            output.append(np.concatenate(chunks[i]))
+        else:
+            prefix = os.path.join(root, "") if root and column in options.get("paths", []) else ""
+            output.append(storage.Packed_Strings.concatenate(chunks[i], prefix=prefix))
+    return output
+
+def scan_folder(folder, extensions=None, leaf=True):
+    """
+    List a folder with os.scandir, which returns the file type together with the name,
+    so nothing needs to be stat-ed on most of the file systems.
+    The result is the same as glob.glob(folder + "/*"), hidden files are ignored.
+    :param extensions: a set of allowed extensions, only used when leaf is True
+    :param leaf: when it is the last level, return all the (filtered) entries,
+            otherwise return the sub-folders only
+    """
+    result = []
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith("."):
+                    continue
+                if leaf:
+                    if extensions is None or name[name.rfind(".") + 1:] in extensions:
+                        result.append(entry.path)
+                elif entry.is_dir():
+                    result.append(entry.path)
+    except (FileNotFoundError, NotADirectoryError, PermissionError):
+        pass
+    return result
+
+
+def iter_path(args, path, dig_level, threads=None):
+    """
+    Generator version of load_path, sub-folders are scanned by a thread pool
+    and the paths are yielded as soon as a folder on the last level is scanned.
+    The order of the result is not deterministic, sort it if you need.
+    :param threads: number of threads, default is args.scan_threads
+    """
+    extensions = frozenset(args.extensions) if args.extensions else None
+    threads = args.scan_threads if threads is None else threads
+    with ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        pending = {pool.submit(scan_folder, path, extensions, dig_level == 0): 0}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                level = pending.pop(future)
+                if level == dig_level:
+                    for sub_path in future.result():
+                        yield sub_path
+                else:
+                    for sub_path in future.result():
+                        pending[pool.submit(scan_folder, sub_path, extensions,
+                                            level + 1 == dig_level)] = level + 1
+
+
+def iter_sorted_path(args, path, dig_level, threads=None, part=None):
+    """
+    Like iter_path, but the folders are scanned in sorted order and the paths inside
+    each last-level folder are sorted, so every process get the same order.
+    At most 2 * threads folders are scanned ahead of the consumer.
+    :param part: (index, count), only yield the index-th of count parts of the paths, e.g. for
+            each DataLoader worker. The last-level folders are split between the parts, so each
+            part only lists its own folders, unless there are less folders than parts,
+            then the paths are split in round-robin.
+    """
+    extensions = frozenset(args.extensions) if args.extensions else None
+    threads = max(args.scan_threads if threads is None else threads, 1)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        current_folders = [path]
+        while dig_level > 0:
+            sub_folders = []
+            for folders in pool.map(scan_folder, current_folders, [None] * len(current_folders),
+                                    [False] * len(current_folders)):
+                sub_folders += sorted(folders)
+            current_folders = sub_folders
+            dig_level -= 1
+        index, count = (0, 1) if part is None else part
+        if len(current_folders) >= count:
+            current_folders, index, count = current_folders[index::count], 0, 1
+        position = itertools.count()
+        pending = deque()
+        for folder in current_folders:
+            pending.append(pool.submit(scan_folder, folder, extensions, True))
+            if len(pending) >= 2 * threads:
+                for sub_path in sorted(pending.popleft().result()):
+                    if next(position) % count == index:
+                        yield sub_path
+        while pending:
+            for sub_path in sorted(pending.popleft().result()):
+                if next(position) % count == index:
+                    yield sub_path
+
 
 def load_path(args, path, dig_level):
+    if args.scan_threads:
+        return list(iter_path(args, path, dig_level))
     current_folders = [path]
     # Do not delete the following line, we need this when dig_level is 0.
     sub_folders = []
@@ -59,6 +211,16 @@ def load_path_from_folder(args, length, paths, dig_level=0):
     output.sort()
     return [output]
 
+def iter_path_from_folder(args, length, paths, dig_level=0, part=None):
+    """
+    Streaming version of load_path_from_folder, used by Streaming_Dataset.
+    Paths are yielded lazily, sorted inside each folder instead of globally.
+    :param part: (index, count), only yield a part of the paths, see iter_sorted_path
+    """
+    if type(paths) is str:
+        paths = [paths]
+    return [itertools.chain.from_iterable(iter_sorted_path(args, path, dig_level, part=part) for path in paths)]
+
 def load_path_from_multi_folder(args, length, paths, dig_level=0):
     """
     The only difference from its sibling "load_path_from_folder"
@@ -96,28 +258,45 @@ def load_cifar_from_pickle(args, length, names, dig_level=0):
         |-data_batch_4 (training data writen in pickle format)
         |-readme.html
         |-test_batch (test data writen in pickle format)
+
+    The batches are converted to one uint8 array in shape of (N, 32, 32, 3) and cached
+    as .npy file (in args.index_cache_dir if specified, otherwise in storage.DEFAULT_CACHE_DIR).
+    The cache is opened by mmap, so every sample is a view of it and DataLoader workers
+    share the same pages instead of holding their own copy.
+    When the cache cannot be written, the arrays are kept in memory.
     """
-    def reshape(img):
-        """
-        transfer a 1D array to RGB image, which cannot be done by numpy reshape
-        """
-        img_R = img[0:1024].reshape((32, 32))
-        img_G = img[1024:2048].reshape((32, 32))
-        img_B = img[2048:3072].reshape((32, 32))
-        return np.dstack((img_R, img_G, img_B))
-    
-    data = []
-    label = []
     if type(names) is str:
         names = [names]
+    names = [os.path.abspath(os.path.expanduser(_)) for _ in names]
+    cache_dir = storage.writable_cache_dir(args)
+    if cache_dir is not None:
+        digest = hashlib.sha1("\n".join(names).encode("utf-8")).hexdigest()[:16]
+        data_path = os.path.join(cache_dir, "cifar_%s_data.npy" % digest)
+        label_path = os.path.join(cache_dir, "cifar_%s_labels.npy" % digest)
+        latest = max([os.path.getmtime(_) for _ in names])
+        if os.path.exists(data_path) and os.path.exists(label_path) \
+                and os.path.getmtime(data_path) >= latest and os.path.getmtime(label_path) >= latest:
+            return np.load(data_path, mmap_mode="r"), np.load(label_path)
+    datas, labels = [], []
     for name in names:
         with open(name, "rb") as db:
             dict = pickle.load(db, encoding="bytes")
-            dim = max([len(dict[_]) for _ in dict.keys()])
-            for i in range(dim):
-                data.append(reshape(dict[misc.str2bytes("data")][i, :]))
-                label.append(dict[misc.str2bytes("labels")][i])
-    return data, label
+            datas.append(dict[misc.str2bytes("data")])
+            labels.append(np.asarray(dict[misc.str2bytes("labels")], dtype=np.int64))
+    # Each row is stored as 1024 R, 1024 G and 1024 B values
+    data = np.concatenate(datas).reshape((-1, 3, 32, 32)).transpose((0, 2, 3, 1))
+    data = np.ascontiguousarray(data)
+    label = np.concatenate(labels)
+    if cache_dir is None:
+        return data, label
+    try:
+        storage.save_array(data_path, data)
+        storage.save_array(label_path, label)
+    except OSError as e:
+        warnings.warn("Cannot write the CIFAR cache in %s (%s), it is kept in memory." % (cache_dir, e))
+        return data, label
+    del data
+    return np.load(data_path, mmap_mode="r"), np.load(label_path)
 
 def load_img_from_path(args, length, names, dig_level=0):
     """
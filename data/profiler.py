@@ -0,0 +1,163 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import math, time
+import multiprocessing as mpi
+import numpy as np
+
+"""
+Wall time of each stage of loading a sample, enabled by args.profile_stages.
+The loading functions are instrumented as:
+
+    start = profiler.tick()
+    image = load_img(...)
+    start = profiler.tock("decode", start)
+
+tick() returns None when no profiler is installed, so the cost is two function calls.
+"""
+
+STAGES = ("decode", "pre_process", "augmentation", "bbox", "to_tensor", "sample")
+
+
+class Stage_Profiler(object):
+    def __init__(self, stages=STAGES, bins_per_decade=16, min_seconds=1e-6, max_seconds=100.0, context=None):
+        """
+        Histograms of the wall time of each stage in log-spaced bins, shared by the DataLoader
+        workers (forked or spawned). Each worker accumulates a sample locally and adds it to
+        the shared counters under one lock in flush().
+
+        Usage:
+            args.profile_stages = True
+            dataset.prepare()
+            for epoch in ...:
+                for batch in DataLoader(dataset, num_workers=4):
+                    ...
+                dataset.profiler.report()
+
+        :param bins_per_decade: resolution of the percentiles, 16 means about 15%
+        :param context: start method of the DataLoader workers, i.e. its multiprocessing_context,
+                None means the default start method. The lock of the counters can only be shared
+                with the processes started by the same method.
+        """
+        self.stages = list(stages)
+        self.bins_per_decade = bins_per_decade
+        self.min_seconds = min_seconds
+        self.bins = int(math.ceil(math.log10(max_seconds / min_seconds) * bins_per_decade)) + 1
+        self.counters = mpi.get_context(context).Array("q", len(self.stages) * self.bins)
+        self.init_local()
+        install(self)
+
+    def init_local(self):
+        self.index = {stage: i for i, stage in enumerate(self.stages)}
+        self.histogram = np.frombuffer(self.counters.get_obj(), dtype=np.int64).reshape(len(self.stages), self.bins)
+        self.pending = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("index", "histogram", "pending"):
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        # Invoked in the DataLoader workers started by spawn
+        self.__dict__.update(state)
+        self.init_local()
+        install(self)
+
+    def record(self, stage, seconds):
+        if stage not in self.index:
+            self.index[stage] = None
+            return
+        if self.index[stage] is None:
+            return
+        position = int(math.log10(max(seconds, self.min_seconds) / self.min_seconds) * self.bins_per_decade)
+        self.pending.append((self.index[stage], min(position, self.bins - 1)))
+
+    def flush(self):
+        if not self.pending:
+            return
+        with self.counters.get_lock():
+            for stage, position in self.pending:
+                self.histogram[stage, position] += 1
+        self.pending = []
+
+    def percentiles(self, stage, quantiles=(0.5, 0.95, 0.99)):
+        """
+        :return: number of records and the percentiles of a stage in seconds, at the upper edge of their bins
+        """
+        counts = self.histogram[self.index[stage]].copy()
+        total = int(counts.sum())
+        if total == 0:
+            return 0, [None] * len(quantiles)
+        cumulative = np.cumsum(counts)
+        positions = [int(np.searchsorted(cumulative, q * total)) for q in quantiles]
+        return total, [self.min_seconds * 10 ** ((p + 1) / self.bins_per_decade) for p in positions]
+
+    def report(self, reset=True):
+        """
+        Print p50 / p95 / p99 of each stage, call it at the end of each epoch
+        :return: a dict of stage: (count, p50, p95, p99)
+        """
+        result = {}
+        print("%-14s%10s%12s%12s%12s" % ("stage", "count", "p50(ms)", "p95(ms)", "p99(ms)"))
+        for stage in self.stages:
+            count, values = self.percentiles(stage)
+            if count == 0:
+                continue
+            result[stage] = (count, *values)
+            print("%-14s%10d%12.3f%12.3f%12.3f" % (stage, count, *[_ * 1000 for _ in values]))
+        if reset:
+            self.reset()
+        return result
+
+    def reset(self):
+        with self.counters.get_lock():
+            self.histogram[:] = 0
+
+
+_profiler = None
+
+
+def install(profiler):
+    global _profiler
+    _profiler = profiler
+
+
+def tick():
+    """
+    :return: the current time, or None when profiling is off
+    """
+    if _profiler is None:
+        return None
+    return time.perf_counter()
+
+
+def tock(stage, start):
+    """
+    Record the time since start to the stage
+    :return: the current time, to be the start of the next stage
+    """
+    if start is None:
+        return None
+    now = time.perf_counter()
+    _profiler.record(stage, now - start)
+    return now
+
+
+def flush():
+    if _profiler is not None:
+        _profiler.flush()
@@ -0,0 +1,140 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import numpy as np
+
+
+class Source_Permutation(object):
+    def __init__(self, length, sources, seed):
+        """
+        An independent permutation of [0, length) for each source in each epoch,
+        used by args.random_order_load to break the correspondence between sources.
+        The permutations only depend on (seed, epoch, source), so every DataLoader
+        worker computes the same ones without any communication.
+        :param length: number of samples
+        :param sources: number of sources (elements in one sample)
+        :param seed: should be decided in the main process, e.g. args.seed
+        """
+        self.length = length
+        self.sources = sources
+        self.seed = seed
+        self.epoch = None
+        self.order = None
+
+    def get(self, epoch):
+        """
+        :return: an array in shape of (sources, length), computed once per epoch
+        """
+        if epoch != self.epoch:
+            dtype = np.int32 if self.length < 2 ** 31 else np.int64
+            self.order = np.empty((self.sources, self.length), dtype=dtype)
+            for i in range(self.sources):
+                rng = np.random.RandomState([self.seed % (2 ** 32), epoch % (2 ** 32), i])
+                self.order[i] = rng.permutation(self.length)
+            self.epoch = epoch
+        return self.order
+
+    def __getstate__(self):
+        # Do not send the cached permutation to DataLoader workers
+        state = self.__dict__.copy()
+        state["epoch"], state["order"] = None, None
+        return state
+
+
+class Aspect_Ratio_Batch_Sampler(object):
+    def __init__(self, sizes, batch_size, ratio_buckets=8, area_buckets=4, drop_last=False, seed=0):
+        """
+        A batch_sampler of DataLoader which only puts images of similar aspect ratio and area
+        into one batch, so less pixels are padded or resized when training on native resolution.
+        Buckets are the quantiles of log(width / height), then of the area inside each of them,
+        so every bucket holds roughly the same number of samples. Images of the same aspect ratio
+        (or area) are never split, so there can be fewer buckets when the sizes repeat.
+
+        Usage:
+            dataset.prescan()
+            sampler = Aspect_Ratio_Batch_Sampler(dataset.image_headers, args.batch_size)
+            DataLoader(dataset, batch_sampler=sampler)
+
+        :param sizes: int array in shape of (N, 2) or more columns, the first two are height and width,
+                e.g. Arbitrary_Dataset.image_headers
+        :param ratio_buckets: number of buckets by aspect ratio
+        :param area_buckets: number of buckets by area inside each aspect ratio bucket
+        :param drop_last: drop the incomplete batch of each bucket
+        :param seed: samples inside each bucket and the order of batches are shuffled by (seed, epoch)
+        """
+        sizes = np.asarray(sizes)
+        assert len(sizes.shape) == 2 and sizes.shape[1] >= 2, "sizes should be in shape of (N, 2)"
+        assert np.all(sizes[:, :2] > 0), "sizes should be positive, quarantine the unreadable images first."
+        self.batch_size = batch_size
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+        height, width = sizes[:, 0].astype(np.float64), sizes[:, 1].astype(np.float64)
+        ratio = self.quantize(np.log(width / height), ratio_buckets)
+        area = np.zeros(len(sizes), dtype=np.int64)
+        log_area = np.log(width * height)
+        for i in range(ratio_buckets):
+            members = np.flatnonzero(ratio == i)
+            area[members] = self.quantize(log_area[members], area_buckets)
+        self.buckets = (ratio * area_buckets + area).astype(np.int32)
+        self.counts = np.bincount(self.buckets, minlength=ratio_buckets * area_buckets)
+
+    @staticmethod
+    def quantize(values, buckets):
+        """
+        Split the values into buckets of roughly the same size at their quantiles.
+        When a quantile falls into a run of equal values (e.g. many images are 4:3), the edge
+        is moved to the nearer end of the run, otherwise the edges collapse into the run
+        and the values after it, however different, end up in one bucket.
+        :return: the bucket of each value
+        """
+        if len(values) == 0:
+            return np.zeros(0, dtype=np.int64)
+        distinct, counts = np.unique(values, return_counts=True)
+        # The values in run i are sorted[starts[i]:ends[i]]
+        ends = np.cumsum(counts)
+        starts = ends - counts
+        positions = np.linspace(0, 1, buckets + 1)[1:-1] * len(values)
+        run = np.searchsorted(ends, positions, side="left")
+        boundaries = np.where(positions - starts[run] < ends[run] - positions, starts[run], ends[run])
+        boundaries = np.unique(boundaries[(boundaries > 0) & (boundaries < len(values))])
+        # The first value of each bucket except the first one
+        edges = distinct[np.searchsorted(ends, boundaries, side="right")]
+        return np.searchsorted(edges, values, side="right")
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        if self.drop_last:
+            return int(np.sum(self.counts // self.batch_size))
+        return int(np.sum((self.counts + self.batch_size - 1) // self.batch_size))
+
+    def __iter__(self):
+        rng = np.random.RandomState([self.seed % (2 ** 32), self.epoch % (2 ** 32)])
+        self.epoch += 1
+        # Shuffle, then a stable sort keeps the shuffled order inside each bucket
+        order = rng.permutation(len(self.buckets))
+        order = order[np.argsort(self.buckets[order], kind="stable")]
+        starts = np.concatenate([[0], np.cumsum(self.counts)[:-1]])
+        batches = []
+        for start, count in zip(starts.tolist(), self.counts.tolist()):
+            end = start + count - (count % self.batch_size if self.drop_last else 0)
+            batches += [(i, min(i + self.batch_size, end)) for i in range(start, end, self.batch_size)]
+        for i in rng.permutation(len(batches)):
+            start, end = batches[i]
+            yield order[start:end].tolist()
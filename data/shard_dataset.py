@@ -0,0 +1,213 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os, json, mmap, pickle, random
+import numpy as np
+import torch
+import omni_torch.data.misc as misc
+from omni_torch.data.arbitrary_dataset import Arbitrary_Dataset
+
+"""
+Shard Structure
+    |
+    |-meta.json (number of samples, fields and the way each field is encoded)
+    |-index.npy (int64 array in shape of [samples, fields, 3], (shard id, offset, length) of each record)
+    |-shard_00000.bin (records of samples written one after another)
+    |-shard_00001.bin
+    |- ...
+"""
+
+# A field is a path of a file, the raw bytes of the file will be written
+FILE = "file"
+# A field is a list or tuple of paths, a pickled list of bytes will be written
+FILES = "files"
+# Anything else, e.g. labels, will be pickled
+PICKLE = "pickle"
+
+
+def field_kind(value):
+    if type(value) is str and os.path.isfile(value):
+        return FILE
+    if (type(value) is tuple or type(value) is list) and len(value) > 0 \
+            and all([type(_) is str and os.path.isfile(_) for _ in value]):
+        return FILES
+    return PICKLE
+
+
+def encode_field(value, kind):
+    if kind == FILE:
+        with open(value, "rb") as file:
+            return file.read()
+    if kind == FILES:
+        contents = []
+        for path in value:
+            with open(path, "rb") as file:
+                contents.append(file.read())
+        return pickle.dumps(contents, protocol=pickle.HIGHEST_PROTOCOL)
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def decode_field(record, kind):
+    if kind == FILE:
+        return bytes(record)
+    return pickle.loads(record)
+
+
+def write_shards(dataset, output_dir, shard_size=2 ** 30):
+    """
+    Pack the step_1 output of a dataset into large sequential shard files,
+    images are kept in their encoded form (jpg, png, etc.)
+    :param dataset: an Arbitrary_Dataset (or its subclass) instance
+    :param output_dir: the folder to write shards to
+    :param shard_size: start a new shard when the current one exceeds this number of bytes
+    :return: number of shards written
+    """
+    if not hasattr(dataset, "dataset"):
+        dataset.prepare()
+    samples = dataset.dataset
+    assert len(samples) > 0, "there is nothing to write."
+    output_dir = os.path.expanduser(output_dir)
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    kinds = [field_kind(value) for value in samples[0]]
+    index = np.zeros((len(samples), len(kinds), 3), dtype=np.int64)
+    shard_id, offset = 0, 0
+    shard = open(os.path.join(output_dir, "shard_%s.bin" % str(shard_id).zfill(5)), "wb")
+    for i, sample in enumerate(samples):
+        assert len(sample) == len(kinds), "every sample should have the same number of fields."
+        if offset >= shard_size:
+            shard.close()
+            shard_id, offset = shard_id + 1, 0
+            shard = open(os.path.join(output_dir, "shard_%s.bin" % str(shard_id).zfill(5)), "wb")
+        for j, value in enumerate(sample):
+            record = encode_field(value, kinds[j])
+            shard.write(record)
+            index[i, j] = (shard_id, offset, len(record))
+            offset += len(record)
+        if i % 10000 == 0:
+            print("{} samples has been written...".format(i))
+    shard.close()
+    np.save(os.path.join(output_dir, "index.npy"), index)
+    with open(os.path.join(output_dir, "meta.json"), "w") as file:
+        json.dump({"samples": len(samples), "kinds": kinds, "shards": shard_id + 1}, file)
+    print("%s samples were written into %s shards at: %s" % (len(samples), shard_id + 1, output_dir))
+    return shard_id + 1
+
+
+class Shard_Dataset(Arbitrary_Dataset, torch.utils.data.IterableDataset):
+    def __init__(self, args, path, step_2, pre_process=None, bbox_loader=None,
+                 augmentation=None, shuffle_buffer=1000, **options):
+        """
+        Read the shards created by write_shards and feed the records to the same step_2
+        functions used by Arbitrary_Dataset, the paths will be replaced by the bytes of files.
+        When iterated (e.g. by a DataLoader), shards are read sequentially, the order of shards
+        is shuffled every epoch and samples are shuffled again inside a buffer.
+        Random access by index is also supported through mmap.
+
+        :param path: the folder contains shards, relative to args.path
+        :param shuffle_buffer: size of the shuffle buffer, 0 means do not shuffle
+        """
+        super().__init__(args, [path], [None], step_2, pre_process=pre_process,
+                         bbox_loader=bbox_loader, augmentation=augmentation, **options)
+        self.shuffle_buffer = shuffle_buffer
+        self.shards = {}
+
+    def prepare(self):
+        self.shard_dir = os.path.join(os.path.expanduser(self.args.path), self.sources[0])
+        print("Loading shards from: %s." % self.shard_dir)
+        with open(os.path.join(self.shard_dir, "meta.json"), "r") as file:
+            meta = json.load(file)
+        assert len(meta["kinds"]) == len(self.step_2), \
+            "shards have %s fields while %s step_2 functions are given" % (len(meta["kinds"]), len(self.step_2))
+        self.kinds = meta["kinds"]
+        self.num_shards = meta["shards"]
+        self.index = np.load(os.path.join(self.shard_dir, "index.npy"), mmap_mode="r")
+        # Drawn in the main process, so every DataLoader worker shuffles the shards in the same order
+        self.shard_seed = self.args.seed if self.args.deterministic_train else random.randint(0, 2 ** 31 - 1)
+        print("Number of samples in dataset is: %s" % (len(self.index)))
+
+    def __getstate__(self):
+        # mmap objects cannot be pickled, each DataLoader worker opens its own
+        state = self.__dict__.copy()
+        state["shards"] = {}
+        return state
+
+    def open_shard(self, shard_id):
+        if shard_id not in self.shards:
+            path = os.path.join(self.shard_dir, "shard_%s.bin" % str(shard_id).zfill(5))
+            with open(path, "rb") as file:
+                self.shards[shard_id] = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(self.shards[shard_id], "madvise") and hasattr(mmap, "MADV_SEQUENTIAL"):
+                self.shards[shard_id].madvise(mmap.MADV_SEQUENTIAL)
+        return self.shards[shard_id]
+
+    def read_sample(self, index):
+        items = []
+        for j, (shard_id, offset, length) in enumerate(self.index[index]):
+            shard = self.open_shard(int(shard_id))
+            items.append(decode_field(shard[offset: offset + length], self.kinds[j]))
+        return items
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        if self.args.deterministic_train:
+            seed = index + self.args.curr_epoch
+        else:
+            seed = random.randint(0, 100000)
+        return self.load_item(self.read_sample(index), seed)
+
+    def samples_of_worker(self):
+        """
+        :return: the indices of samples this worker should read, in the order of reading
+        """
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        shard_order = list(range(self.num_shards))
+        if self.shuffle_buffer:
+            # The same permutation in all the workers, otherwise they read overlapping shards
+            random.Random(self.shard_seed + self.args.curr_epoch).shuffle(shard_order)
+        shard_of_sample = self.index[:, 0, 0]
+        if self.num_shards >= num_workers:
+            # Each worker reads whole shards so every read is sequential
+            for shard_id in shard_order[worker_id::num_workers]:
+                for index in np.flatnonzero(shard_of_sample == shard_id):
+                    yield int(index)
+        else:
+            for shard_id in shard_order:
+                for index in np.flatnonzero(shard_of_sample == shard_id)[worker_id::num_workers]:
+                    yield int(index)
+
+    def __iter__(self):
+        if self.args.deterministic_train:
+            rng = random.Random(self.args.seed + self.args.curr_epoch)
+        else:
+            rng = random.Random()
+        indices = self.samples_of_worker()
+        if self.shuffle_buffer:
+            # Decoding happens after shuffle, the buffer only holds the encoded bytes
+            samples = misc.shuffle_buffer(((index, self.read_sample(index)) for index in indices),
+                                          self.shuffle_buffer, rng)
+        else:
+            samples = ((index, self.read_sample(index)) for index in indices)
+        for index, items in samples:
+            if self.args.deterministic_train:
+                seed = index + self.args.curr_epoch
+            else:
+                seed = rng.randint(0, 100000)
+            yield self.load_item(items, seed)
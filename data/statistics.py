@@ -0,0 +1,164 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import time, multiprocessing
+import numpy as np
+import omni_torch.data.storage as storage
+import omni_torch.data.data_loader as loader
+
+
+class Channel_Statistics(object):
+    def __init__(self, channels, bins=256, img_bit=8):
+        """
+        Per-channel count, mean, sum of squared deviations (M2) and histogram of pixel values,
+        accumulated image by image and merged by the parallel algorithm of Welford (Chan et al.),
+        so the accumulators of different processes can be merged in any order.
+        Values are accumulated in raw intensity, mean and std are reported after dividing
+        by 2 ** img_bit, the same as utils.normalize_image.
+        """
+        self.channels = channels
+        self.bins = bins
+        self.img_bit = img_bit
+        self.count = 0
+        self.mean = np.zeros(channels, dtype=np.float64)
+        self.m2 = np.zeros(channels, dtype=np.float64)
+        self.histogram = np.zeros((channels, bins), dtype=np.int64)
+        self.images = 0
+
+    def merge_moments(self, count, mean, m2):
+        total = self.count + count
+        if total == 0:
+            return
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def update(self, image):
+        """
+        :param image: integer array in shape of (H, W) or (H, W, C), raw intensity.
+                A gray image is counted in every channel, as if it was converted to BGR.
+        """
+        channels = 1 if len(image.shape) == 2 else image.shape[2]
+        if channels != self.channels and channels != 1:
+            raise ValueError("image has %d channels while %d are expected." % (channels, self.channels))
+        pixels = image.reshape(-1, channels)
+        count = len(pixels)
+        if count == 0:
+            return
+        shift = self.img_bit - int(np.log2(self.bins))
+        mean, m2 = np.zeros(channels), np.zeros(channels)
+        histogram = np.zeros((channels, self.bins), dtype=np.int64)
+        for c in range(channels):
+            values = pixels[:, c].astype(np.int64)
+            # Sums of integers are exact, so no precision is lost for 16-bit images
+            s1, s2 = int(values.sum()), int(np.dot(values, values))
+            mean[c], m2[c] = s1 / count, (count * s2 - s1 ** 2) / count
+            values = values >> shift if shift >= 0 else values << -shift
+            histogram[c] = np.bincount(np.clip(values, 0, self.bins - 1), minlength=self.bins)
+        # Broadcast to self.channels when the image is gray
+        self.histogram += histogram
+        self.merge_moments(count, mean, m2)
+        self.images += 1
+
+    def merge(self, other):
+        self.merge_moments(other.count, other.mean, other.m2)
+        self.histogram += other.histogram
+        self.images += other.images
+        return self
+
+    @property
+    def normalized_mean(self):
+        return self.mean / 2 ** self.img_bit
+
+    @property
+    def normalized_std(self):
+        variance = self.m2 / max(self.count, 1)
+        return np.sqrt(variance) / 2 ** self.img_bit
+
+
+def scan_chunk(task):
+    args, paths, bins, size = task
+    statistics = Channel_Statistics(args.img_channel, bins, args.img_bit)
+    for path in paths:
+        image = loader.decode_img(args, path, loader.plan_decode(args, path, size))
+        if len(image.shape) == 2:
+            image = np.expand_dims(image, axis=-1)
+        statistics.update(image)
+    return statistics
+
+
+def image_paths(dataset, field=0):
+    if isinstance(dataset.dataset, storage.Column_Dataset):
+        return dataset.dataset.columns[field]
+    return [sample[field] for sample in dataset.dataset]
+
+
+def compute_statistics(dataset, field=0, processes=None, subsample=None, seed=0, bins=256,
+                       size=None, chunk_size=64):
+    """
+    Stream the images of a prepared Arbitrary_Dataset through a process pool and compute
+    per-channel mean, std and histogram of their raw pixels, before any augmentation.
+
+    Usage:
+        dataset.prepare()
+        statistics = compute_statistics(dataset, subsample=10000)
+        apply_statistics(args, statistics)
+
+    :param field: index of the image paths in each sample
+    :param processes: size of the process pool, None means the number of CPUs, 0 means in this process
+    :param subsample: only read this number of randomly chosen images, None means all
+    :param bins: number of histogram bins, should be a power of 2
+    :param size: (height, width), with args.fast_decode JPEG files are decoded in the reduced
+            resolution which is not smaller than it, e.g. (64, 64), which is several times faster
+            and hardly changes the statistics
+    :return: Channel_Statistics
+    """
+    args = dataset.args
+    paths = image_paths(dataset, field)
+    if subsample is not None and subsample < len(paths):
+        indices = np.sort(np.random.RandomState(seed).choice(len(paths), subsample, replace=False))
+    else:
+        indices = np.arange(len(paths))
+    # Tasks are created lazily, so the paths of the whole dataset are never copied at once
+    tasks = ((args, [paths[int(i)] for i in indices[start: start + chunk_size]], bins, size)
+             for start in range(0, len(indices), chunk_size))
+    statistics = Channel_Statistics(args.img_channel, bins, args.img_bit)
+    start_time = time.time()
+    if processes == 0:
+        for task in tasks:
+            statistics.merge(scan_chunk(task))
+    else:
+        with multiprocessing.Pool(processes) as pool:
+            for result in pool.imap_unordered(scan_chunk, tasks):
+                statistics.merge(result)
+    print("Statistics of %d images computed in %.1f seconds." % (statistics.images, time.time() - start_time))
+    return statistics
+
+
+def apply_statistics(args, statistics):
+    """
+    Write the mean and std into args.img_mean and args.img_std
+    """
+    mean, std = statistics.normalized_mean, statistics.normalized_std
+    if len(mean) == 1:
+        # utils.normalize_image combines the 3 channels for gray images,
+        # the weights of the mean sum up to 1
+        mean, std = np.repeat(mean, 3), np.repeat(std, 3)
+    args.img_mean = tuple([float(_) for _ in mean])
+    args.img_std = tuple([float(_) for _ in std])
+    return args
@@ -0,0 +1,234 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os, numbers, warnings
+import numpy as np
+
+# Used for the sidecar files when args.index_cache_dir is not set, so the dataset folder is never written
+DEFAULT_CACHE_DIR = os.path.join("~", ".cache", "omni_torch")
+
+"""
+Containers of dataset index without one Python object per item. Forked DataLoader
+workers only read these buffers, so no page is copied by reference counting.
+"""
+
+
+def save_array(path, array):
+    """
+    np.save through a temporary file, other processes (e.g. other DDP ranks) loading
+    the file by mmap will never see a half-written array
+    """
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp_path, "wb") as file:
+        np.save(file, array)
+    os.replace(tmp_path, path)
+
+
+def writable_cache_dir(args):
+    """
+    Return args.index_cache_dir (or DEFAULT_CACHE_DIR if not set), created when missing.
+    None is returned when it cannot be created or written, e.g. on a read-only file system,
+    then the caller keeps what it builds in memory.
+    """
+    cache_dir = os.path.expanduser(args.index_cache_dir if args.index_cache_dir else DEFAULT_CACHE_DIR)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        warnings.warn("Cannot create the cache folder %s (%s), nothing will be cached." % (cache_dir, e))
+        return None
+    if not os.access(cache_dir, os.W_OK):
+        warnings.warn("Cache folder %s is not writable, nothing will be cached." % cache_dir)
+        return None
+    return cache_dir
+
+
+class Packed_Strings(object):
+    def __init__(self, offsets, buffer, prefix=""):
+        """
+        Strings encoded in utf-8 and joined by b"\\0" in one uint8 buffer.
+        :param offsets: int64 array, offsets[i] is the start of i-th string,
+                the last element is len(buffer) + 1
+        :param buffer: uint8 array
+        :param prefix: a string prepended to each item when read, e.g. root folder of the dataset
+        """
+        self.offsets = offsets
+        self.buffer = buffer
+        self.prefix = prefix
+
+    @staticmethod
+    def from_list(strings, prefix=""):
+        if len(strings) == 0:
+            return Packed_Strings(np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.uint8), prefix)
+        buffer = np.frombuffer("\0".join(strings).encode("utf-8"), dtype=np.uint8)
+        offsets = np.empty(len(strings) + 1, dtype=np.int64)
+        offsets[0] = 0
+        offsets[1:-1] = np.flatnonzero(buffer == 0) + 1
+        offsets[-1] = len(buffer) + 1
+        return Packed_Strings(offsets, buffer, prefix)
+
+    @staticmethod
+    def concatenate(packed_list, prefix=""):
+        packed_list = [_ for _ in packed_list if len(_) > 0]
+        if not packed_list:
+            return Packed_Strings.from_list([], prefix)
+        buffers, offsets, start = [], [np.zeros(1, dtype=np.int64)], 0
+        for packed in packed_list:
+            buffers.append(packed.buffer)
+            offsets.append(packed.offsets[1:] + start)
+            start += len(packed.buffer) + 1
+        # The strings of two packs are separated by b"\0" as well
+        buffer = np.concatenate([np.concatenate([_, np.zeros(1, dtype=np.uint8)]) for _ in buffers])[:-1]
+        return Packed_Strings(np.concatenate(offsets), buffer, prefix)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        start, end = self.offsets[index], self.offsets[index + 1] - 1
+        return self.prefix + self.buffer[start:end].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def save(self, path):
+        """
+        :param path: offsets and buffer are saved to path + "_offsets.npy" and path + "_buffer.npy"
+        """
+        save_array(path + "_offsets.npy", self.offsets)
+        save_array(path + "_buffer.npy", self.buffer)
+
+    @staticmethod
+    def load(path, prefix="", mmap_mode="r"):
+        return Packed_Strings(np.load(path + "_offsets.npy", mmap_mode=mmap_mode),
+                              np.load(path + "_buffer.npy", mmap_mode=mmap_mode), prefix)
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(path + "_offsets.npy") and os.path.exists(path + "_buffer.npy")
+
+
+class Column_Dataset(object):
+    def __init__(self, columns):
+        """
+        Replacement of the list of samples built by Arbitrary_Dataset.load_dataset,
+        dataset[i] returns [column[i] for column in columns].
+        :param columns: Packed_Strings, numpy arrays or anything supports len() and indexing
+        """
+        assert len(set([len(_) for _ in columns])) == 1, "all columns should have the same length."
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        return [column[index] for column in self.columns]
+
+
+class Subset_Dataset(object):
+    def __init__(self, dataset, indices):
+        """
+        Samples of dataset at the given indices, without copying them
+        :param indices: int array
+        """
+        if isinstance(dataset, Subset_Dataset):
+            indices = dataset.indices[indices]
+            dataset = dataset.dataset
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index):
+        return self.dataset[int(self.indices[index])]
+
+
+class Appendable_Dataset(object):
+    def __init__(self, dataset):
+        """
+        A dataset which only grows, samples are appended in parts and never move,
+        so their indices stay valid. Used by Arbitrary_Dataset.refresh.
+        """
+        self.parts = [dataset]
+        self.offsets = np.array([0, len(dataset)], dtype=np.int64)
+
+    def append(self, samples):
+        self.parts.append(samples)
+        self.offsets = np.append(self.offsets, self.offsets[-1] + len(samples))
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if len(self.parts) == 1:
+            return self.parts[0][index]
+        part = int(np.searchsorted(self.offsets, index, side="right")) - 1
+        return self.parts[part][index - int(self.offsets[part])]
+
+
+class Packed_Tuples(object):
+    def __init__(self, columns):
+        """
+        Tuples of the same length, e.g. the output of path_loader.load_path_from_multi_folder,
+        each position of the tuples is stored in its own column.
+        """
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        return tuple([column[index] for column in self.columns])
+
+
+def pack_column(values):
+    """
+    Convert a list of values into a container without per-item Python objects when possible.
+    :return: Packed_Strings, Packed_Tuples, numpy array, or the list itself when
+            the values cannot be packed
+    """
+    if len(values) == 0:
+        return values
+    first = values[0]
+    if all([type(_) is str for _ in values]):
+        return Packed_Strings.from_list(values)
+    if type(first) is tuple or type(first) is list:
+        width = len(first)
+        if all([(type(_) is tuple or type(_) is list) and len(_) == width for _ in values]):
+            columns = [pack_column([_[i] for _ in values]) for i in range(width)]
+            if all([type(_) is not list for _ in columns]):
+                return Packed_Tuples(columns)
+        return values
+    if all([isinstance(_, numbers.Number) and not isinstance(_, bool) for _ in values]):
+        return np.asarray(values)
+    if isinstance(first, np.ndarray) and all([isinstance(_, np.ndarray) and _.shape == first.shape
+                                               and _.dtype == first.dtype for _ in values]):
+        return np.stack(values)
+    return values
+
+
+def pack_dataset(dataset):
+    """
+    :param dataset: list of samples, the output of Arbitrary_Dataset.load_dataset
+    :return: a Column_Dataset, or the dataset itself if it is empty
+    """
+    if len(dataset) == 0 or isinstance(dataset, (Column_Dataset, Subset_Dataset, Appendable_Dataset)):
+        return dataset
+    return Column_Dataset([pack_column([sample[i] for sample in dataset]) for i in range(len(dataset[0]))])
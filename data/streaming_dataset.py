@@ -0,0 +1,104 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os, random, itertools
+import torch
+import omni_torch.data.misc as misc
+import omni_torch.data.path_loader as path_loader
+from omni_torch.data.arbitrary_dataset import Arbitrary_Dataset
+
+
+class Streaming_Dataset(Arbitrary_Dataset, torch.utils.data.IterableDataset):
+    # step_1 functions accepting part=(index, count) to list only a part of their source
+    sharded_step_1 = (path_loader.iter_path_from_folder,)
+
+    def __init__(self, args, sources, step_1, step_2, pre_process=None, bbox_loader=None,
+                 auxiliary_info=None, augmentation=None, shuffle_buffer=0, **options):
+        """
+        Stream the output of step_1 instead of building the whole dataset in prepare(),
+        so training starts before the listing is finished and the memory does not grow
+        with the size of dataset.
+        step_1 functions return the same layout as in Arbitrary_Dataset, but each
+        element can be an iterator, e.g. path_loader.iter_path_from_folder.
+        Elements from different sources are zipped, so the stream stops at the shortest one.
+        When every step_1 is in sharded_step_1, each DataLoader worker only lists its own
+        part of the sources, so all sources should be split the same way, e.g. have the same
+        folder layout. Otherwise, samples are distributed to DataLoader workers in round-robin,
+        thus step_1 should yield in the same order in every worker.
+
+        :param shuffle_buffer: shuffle the stream inside a buffer of this size, 0 means do not shuffle
+        """
+        super().__init__(args, sources, step_1, step_2, pre_process=pre_process, bbox_loader=bbox_loader,
+                         auxiliary_info=auxiliary_info, augmentation=augmentation, **options)
+        self.shuffle_buffer = shuffle_buffer
+
+    def prepare(self):
+        for i, source in enumerate(self.sources):
+            if type(source) is str:
+                self.show_sub_folder_data(source, i)
+            else:
+                for sub_source in source:
+                    self.show_sub_folder_data(sub_source, i)
+
+    def __len__(self):
+        raise TypeError("Streaming_Dataset does not know its length before the stream ends.")
+
+    def iter_dataset(self, part=None):
+        """
+        Lazy version of Arbitrary_Dataset.load_dataset
+        :param part: (index, count), passed to step_1 functions in sharded_step_1
+        """
+        data = []
+        path = os.path.expanduser(self.args.path)
+        for i in range(len(self.step_1)):
+            source = self.sources[i]
+            if type(source) is str:
+                sub_path = os.path.join(path, source)
+            elif type(source) is tuple or type(source) is list:
+                sub_path = [os.path.join(path, _) for _ in source]
+            else:
+                raise TypeError
+            if not callable(self.step_1[i]):
+                raise NotImplementedError
+            if part is None:
+                elements = self.step_1[i](self.args, len(data), sub_path, self.auxiliary[i])
+            else:
+                elements = self.step_1[i](self.args, len(data), sub_path, self.auxiliary[i], part=part)
+            data += [iter(_) for _ in elements]
+        return zip(*data)
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        if all([step_1 in self.sharded_step_1 for step_1 in self.step_1]):
+            # Each worker only lists its own part, the index is made unique across workers
+            samples = ((index * num_workers + worker_id, items) for index, items in
+                       enumerate(self.iter_dataset(part=(worker_id, num_workers))))
+        else:
+            samples = itertools.islice(enumerate(self.iter_dataset()), worker_id, None, num_workers)
+        if self.args.deterministic_train:
+            rng = random.Random(self.args.seed + self.args.curr_epoch + worker_id)
+        else:
+            rng = random.Random()
+        if self.shuffle_buffer:
+            samples = misc.shuffle_buffer(samples, self.shuffle_buffer, rng)
+        for index, items in samples:
+            if self.args.deterministic_train:
+                seed = index + self.args.curr_epoch
+            else:
+                seed = rng.randint(0, 100000)
+            yield self.load_item(list(items), seed)
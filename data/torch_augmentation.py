@@ -0,0 +1,231 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import math, time
+import torch
+import torch.nn.functional as F
+
+
+def uniform(generator, size, value_range, device):
+    """
+    Sample from U(low, high) when value_range is a tuple or list, otherwise return the constant
+    """
+    if type(value_range) is tuple or type(value_range) is list:
+        low, high = value_range
+        return torch.rand(size, generator=generator, device=device) * (high - low) + low
+    return torch.full(size, float(value_range), device=device)
+
+
+class Torch_Augmentation(object):
+    def __init__(self, args):
+        """
+        Batched augmentation by vectorized torch ops, an alternative of augmentation.prepare_augmentation.
+        The same options are used: do_affine, do_crop_to_fix_size, do_pad_to_fix_size,
+        do_random_flip, do_random_brightness and do_random_noise, applied in the "default"
+        order of prepare_augmentation. Every sample has its own random parameters.
+        Input should be a (B, C, H, W) tensor of uint8, or float in the range of [0, 2 ** args.img_bit - 1],
+        i.e. before normalization. The tensor can be on any device.
+        """
+        self.args = args
+        self.ops = []
+        if args.do_affine:
+            self.ops.append(self.affine)
+        if args.do_crop_to_fix_size:
+            self.ops.append(self.crop_to_fix)
+        if args.do_pad_to_fix_size:
+            self.ops.append(self.pad_to_fix)
+        if args.do_random_flip:
+            self.ops.append(self.flip)
+        if args.do_random_brightness:
+            self.ops.append(self.brightness)
+        if args.do_random_noise:
+            self.ops.append(self.gaussian_blur)
+
+    def __call__(self, images, seed=None):
+        """
+        :param images: (B, C, H, W) tensor
+        :param seed: make the random parameters reproducible
+        :return: augmented images with the same dtype
+        """
+        generator = torch.Generator(device=images.device)
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        dtype = images.dtype
+        max_value = 255.0 if dtype == torch.uint8 else float(2 ** self.args.img_bit - 1)
+        images = images.float()
+        for op in self.ops:
+            images = op(images, generator, max_value)
+        if dtype == torch.uint8:
+            return images.round_().clamp_(0, 255).to(torch.uint8)
+        return images.to(dtype)
+
+    def affine(self, images, generator, max_value):
+        args = self.args
+        b, _, h, w = images.shape
+        device = images.device
+        scale_x = uniform(generator, (b,), args.scale_x, device)
+        scale_y = uniform(generator, (b,), args.scale_y, device)
+        rotate = uniform(generator, (b,), args.rotation, device) * math.pi / 180
+        shear = uniform(generator, (b,), args.shear, device) * math.pi / 180
+        translate_x = uniform(generator, (b,), args.translation_x, device) * w
+        translate_y = uniform(generator, (b,), args.translation_y, device) * h
+        # Forward matrix in pixels: translate(center + t) * rotate * shear * scale * translate(-center)
+        cos, sin, tan = torch.cos(rotate), torch.sin(rotate), torch.tan(shear)
+        a = torch.stack([torch.stack([cos, -sin], -1), torch.stack([sin, cos], -1)], -2)
+        a = a @ torch.stack([torch.stack([torch.ones_like(tan), -tan], -1),
+                             torch.stack([torch.zeros_like(tan), torch.ones_like(tan)], -1)], -2)
+        a = a * torch.stack([scale_x, scale_y], -1)[:, None, :]
+        center = torch.tensor([(w - 1) / 2, (h - 1) / 2], device=device)
+        t = center + torch.stack([translate_x, translate_y], -1) - (a @ center[:, None])[..., 0]
+        # affine_grid needs the inverse matrix in normalized coordinates
+        inverse = torch.inverse(a)
+        inverse_t = -(inverse @ t[..., None])[..., 0]
+        norm = torch.tensor([w / 2, h / 2], device=device)
+        offset = torch.tensor([w / 2 - 0.5, h / 2 - 0.5], device=device)
+        theta_a = inverse * norm[None, None, :] / norm[None, :, None]
+        theta_t = ((inverse @ offset[:, None])[..., 0] + inverse_t - offset) / norm
+        theta = torch.cat([theta_a, theta_t[..., None]], -1)
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        # Zero padding of (images - cval) fills the background with cval
+        cval = float(args.aug_bg_color)
+        return F.grid_sample(images - cval, grid, mode="bilinear", padding_mode="zeros",
+                             align_corners=False) + cval
+
+    def crop_to_fix(self, images, generator, max_value):
+        b, _, h, w = images.shape
+        height, width = min(self.args.crop_size[0], h), min(self.args.crop_size[1], w)
+        top = (torch.rand(b, generator=generator, device=images.device) * (h - height + 1)).long()
+        left = (torch.rand(b, generator=generator, device=images.device) * (w - width + 1)).long()
+        # Slicing each sample is cheaper than advanced indexing of the whole batch
+        return torch.stack([image[:, y:y + height, x:x + width] for image, y, x
+                            in zip(images, top.tolist(), left.tolist())])
+
+    def pad_to_fix(self, images, generator, max_value):
+        args = self.args
+        padding_size = args.padding_size[0] if type(args.padding_size[0]) in (tuple, list) else args.padding_size
+        b, c, h, w = images.shape
+        height, width = max(padding_size[0], h), max(padding_size[1], w)
+        if args.padding_position == "uniform":
+            position_y = torch.rand(b, generator=generator, device=images.device)
+            position_x = torch.rand(b, generator=generator, device=images.device)
+        else:
+            # (x, y) in [0, 1], 1 means the image starts at the beginning
+            position_x = torch.full((b,), float(args.padding_position[0]), device=images.device)
+            position_y = torch.full((b,), float(args.padding_position[1]), device=images.device)
+        # The same as imgaug.augmenters.PadToFixedSize
+        top = ((1 - position_y) * (height - h)).long()
+        left = ((1 - position_x) * (width - w)).long()
+        output = torch.full((b, c, height, width), float(args.aug_bg_color), device=images.device)
+        for i, (y, x) in enumerate(zip(top.tolist(), left.tolist())):
+            output[i, :, y:y + h, x:x + w] = images[i]
+        return output
+
+    def flip(self, images, generator, max_value):
+        b = images.shape[0]
+        horizontal = torch.rand(b, generator=generator, device=images.device) < self.args.h_flip_prob
+        vertical = torch.rand(b, generator=generator, device=images.device) < self.args.v_flip_prob
+        # Only the selected samples are copied
+        images[horizontal] = images[horizontal].flip(-1)
+        images[vertical] = images[vertical].flip(-2)
+        return images
+
+    def brightness(self, images, generator, max_value):
+        """
+        ContrastNormalization, Multiply and LinearContrast are linear, so they are folded
+        into one images * scale + offset. Unlike imgaug, values are clipped only at the end.
+        """
+        args = self.args
+        b, c = images.shape[:2]
+        center = (max_value + 1) / 2
+        contrast = uniform(generator, (b, 1, 1, 1), args.brightness_vibrator, images.device)
+        size = (b, c, 1, 1) if args.multiplier_per_channel else (b, 1, 1, 1)
+        multiplier = uniform(generator, size, args.multiplier, images.device)
+        linear = uniform(generator, (b, 1, 1, 1), args.linear_contrast, images.device)
+        # ((x - center) * contrast + center) * multiplier, then (y - center) * linear + center
+        scale = contrast * multiplier * linear
+        offset = (center * (1 - contrast) * multiplier - center) * linear + center
+        return torch.addcmul(offset, images, scale).clamp_(0, max_value)
+
+    def gaussian_blur(self, images, generator, max_value):
+        b, c, h, w = images.shape
+        sigma = uniform(generator, (b,), self.args.gaussian_sigma, images.device)
+        max_sigma = float(sigma.max())
+        if max_sigma <= 0:
+            return images
+        radius = int(math.ceil(3 * max_sigma))
+        x = torch.arange(-radius, radius + 1, device=images.device, dtype=torch.float32)
+        kernel = torch.exp(-x[None, :] ** 2 / (2 * sigma[:, None].clamp(min=1e-3) ** 2))
+        # Sigma 0 means do not blur
+        kernel = torch.where(sigma[:, None] > 0, kernel, (x[None, :] == 0).float())
+        kernel = kernel / kernel.sum(dim=1, keepdim=True)
+        kernel = kernel.repeat_interleave(c, dim=0)
+        images = F.pad(images.reshape(1, b * c, h, w), [radius] * 4, mode="replicate")
+        images = F.conv2d(images, kernel[:, None, :, None], groups=b * c)
+        images = F.conv2d(images, kernel[:, None, None, :], groups=b * c)
+        return images.reshape(b, c, h, w)
+
+
+def benchmark(args, batch_size=32, size=(256, 256), iterations=10):
+    """
+    Compare the throughput (images per second) of imgaug (augmentation.prepare_augmentation)
+    and Torch_Augmentation on the same options
+    """
+    import numpy as np
+    from imgaug import augmenters
+    import omni_torch.data.augmentation as aug
+    images = np.random.randint(0, 256, size=(batch_size, size[0], size[1], 3), dtype=np.uint8)
+    result = {}
+    sequence = augmenters.Sequential(aug.prepare_augmentation(args), random_order=False)
+    start = time.time()
+    for _ in range(iterations):
+        sequence.to_deterministic().augment_images(list(images))
+    result["imgaug"] = batch_size * iterations / (time.time() - start)
+    engine = Torch_Augmentation(args)
+    devices = ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    for device in devices:
+        batch = torch.from_numpy(images).permute(0, 3, 1, 2).contiguous().to(device)
+        engine(batch)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        start = time.time()
+        for _ in range(iterations):
+            engine(batch)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        result["torch_%s" % device] = batch_size * iterations / (time.time() - start)
+    return result
+
+
+if __name__ == "__main__":
+    import omni_torch.options.options_edict as edict_options
+    args = edict_options.initialize()
+    # Not defined in options_edict but read by prepare_augmentation
+    args.do_resize, args.do_crop = False, False
+    args.do_affine = True
+    args.rotation = (-15, 15)
+    args.scale_x, args.scale_y = (0.9, 1.1), (0.9, 1.1)
+    args.do_crop_to_fix_size = True
+    args.crop_size = (224, 224)
+    args.do_random_flip = True
+    args.do_random_brightness = True
+    args.multiplier = (0.8, 1.2)
+    args.do_random_noise = True
+    args.gaussian_sigma = (0, 1.0)
+    for key, value in benchmark(args).items():
+        print("%s: %.1f images/s" % (key, value))
@@ -27,6 +27,8 @@ def initialize():
         "create_path":True,
         "path": None,  # the directory contains the datasets
         "extensions": ["jpeg", "JPG", "jpg", "png", "PNG", "gif", "tiff"],
+        # threads to scan the sub-folders with os.scandir, 0 means use glob in a single thread
+        "scan_threads": 8,
 
         "gpu_id": None,
         "output_gpu_id": 0,
@@ -51,16 +53,50 @@ def initialize():
         
         "loading_threads": 1, # how many cpu core to use to load data, usually 4 is sufficient
         "random_order_load": False,
+        # folder to keep the on-disk cache of dataset index, None means do not use the cache,
+        # other sidecar files (e.g. CIFAR arrays, image headers) then go to ~/.cache/omni_torch
+        "index_cache_dir": None,
+        # ignore the existing index cache and rebuild it
+        "index_cache_rebuild": False,
+        # keep the dataset index in numpy buffers instead of python lists,
+        # so the memory of forked DataLoader workers does not grow
+        "compact_dataset": False,
+        # read the image headers of the first field in Arbitrary_Dataset.prepare() and quarantine
+        # the unreadable images, see Arbitrary_Dataset.prescan
+        "prescan_headers": False,
+        # record the wall time of each stage of loading a sample, see data/profiler.py
+        "profile_stages": False,
+        # record the mtime of the source folders in Arbitrary_Dataset.prepare(), so that
+        # Arbitrary_Dataset.refresh() can pick up the added and deleted files
+        "incremental_refresh": False,
         
         "img_channel": 3,
         "img_mean": (0.5, 0.5, 0.5),
         "img_std": (1.0, 1.0, 1.0),
         "img_bias": (0.0, 0.0, 0.0),
         "img_bit": 8,
+        # memory budget (in bytes) of the decoded image cache in each process, 0 means no cache
+        "img_cache_bytes": 0,
+        # decode JPEG in reduced resolution when the image will be resized to final_size,
+        # read_image will resize the image to final_size at the end
+        "fast_decode": False,
+        # size (in bytes) of the decoded image cache shared by all DataLoader workers, 0 means no cache
+        "shared_img_cache_bytes": 0,
+        # multiprocessing_context of the DataLoader using the shared cache or args.profile_stages,
+        # e.g. "spawn", None means the default start method
+        "shared_img_cache_context": None,
         
         # Below options will be deprecated in the Future
         "do_imgaug": False,
         "imgaug_order": "default",
+        # augment the whole batch in collate.Batch_Augmentation instead of each sample in __getitem__
+        "batch_imgaug": False,
+        # "imgaug" or "torch", the latter augments the batch by torch_augmentation.Torch_Augmentation
+        # built from the options below, images of one batch should have the same size
+        "batch_aug_backend": "imgaug",
+        # fold the geometric augmentations (and the resize of fast_decode) into one cv2.warpAffine,
+        # see data/geometry.py
+        "single_warp": False,
         # default or a list, ["affine", "crop", "pad", ...], each element represent a process
         "do_affine": False, # See Documentation of imgaug affine
         # numbers in translations means pixel
@@ -100,6 +136,11 @@ def initialize():
         "final_size": (224, 224),
         "standardize_size": False,
         "standardize_gcd": 8,
+        # Image Segmentation, see data_loader_ops.segment_image
+        "segments": None,
+        "segment_patch_size": None,
+        # distance between two neighbouring patches, None means equal to segment_patch_size
+        "segment_stride": None,
     })
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import os
+import cv2
+import numpy as np
+import pytest
+from imgaug import augmenters
+import omni_torch.options.options_edict as options_edict
+import omni_torch.data.data_loader as loader
+
+
+@pytest.mark.parametrize("single_warp", [False, True])
+@pytest.mark.parametrize("extension, rand_aug", [
+    # Decoded in 1/4 resolution with fast_decode
+    ("jpg", lambda: [augmenters.Resize({"height": 50, "width": 40})]),
+    # Crop is defined in pixels, so the full resolution is decoded
+    ("jpg", lambda: [augmenters.CropToFixedSize(width=64, height=48)]),
+    # Only JPEG files can be decoded in a reduced resolution
+    ("png", lambda: None),
+])
+def test_fast_decode_keeps_shape(tmp_path, single_warp, extension, rand_aug):
+    path = os.path.join(str(tmp_path), "image.%s" % extension)
+    cv2.imwrite(path, np.random.RandomState(0).randint(0, 256, size=(300, 400, 3)).astype(np.uint8))
+    shapes = []
+    for fast_decode in (False, True):
+        args = options_edict.initialize()
+        args.fast_decode = fast_decode
+        args.single_warp = single_warp
+        image = loader.read_image(args, path, 0, (50, 40), rand_aug=rand_aug(), _to_tensor=False)
+        shapes.append(image.shape)
+    assert shapes[0] == shapes[1]
@@ -0,0 +1,41 @@
+"""
+# Copyright (c) 2018 Works Applications Co., Ltd.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+
+import numpy as np
+import pytest
+from omni_torch.data.statistics import Channel_Statistics
+
+
+def test_mixed_gray_and_color():
+    rng = np.random.RandomState(0)
+    color = rng.randint(0, 256, size=(10, 12, 3)).astype(np.uint8)
+    gray = rng.randint(0, 256, size=(10, 12)).astype(np.uint8)
+    statistics = Channel_Statistics(3)
+    statistics.update(color)
+    statistics.update(gray)
+    assert statistics.count == 240
+    # The gray image is counted in every channel
+    expected = np.concatenate([color.reshape(-1, 3), np.repeat(gray.reshape(-1, 1), 3, axis=1)]).astype(np.float64)
+    assert np.allclose(statistics.mean, expected.mean(axis=0))
+    assert np.allclose(statistics.normalized_std, expected.std(axis=0) / 256)
+    assert np.all(statistics.histogram.sum(axis=1) == 240)
+
+
+def test_channel_mismatch():
+    statistics = Channel_Statistics(3)
+    with pytest.raises(ValueError):
+        statistics.update(np.zeros((10, 12, 4), dtype=np.uint8))